@@ -0,0 +1,236 @@
+"""Carga sobre la app FastAPI real (main.app) con upstreams locales: Supabase en memoria, yfinance y RSS falsos.
+
+Cada escenario simula sesiones de usuario concurrentes y arranca con las cachés vacías. Por endpoint se
+informa de p50/p99 de latencia y llamadas a upstreams por petición (de su cabecera Server-Timing); por
+escenario, de peticiones/s y del total de llamadas que ven los upstreams falsos. Sirve para detectar
+regresiones en los caminos N+1 y de descarga por ticker.
+
+Uso: python benchmarks/bench_api.py [--users 20] [--portfolios 3] [--assets 10] [--sessions 40] [--concurrency 10]
+                                    [--db-latency 0.02] [--market-latency 0.2] [--rss-latency 0.1]
+                                    [--scenarios dashboard,overview,...] [--json salida.json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import tempfile
+import argparse
+from collections import Counter, defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+_tmp = tempfile.mkdtemp(prefix="fandance-bench-")
+os.environ.setdefault("HISTORY_DIR", os.path.join(_tmp, "history"))
+os.environ.setdefault("SEARCH_INDEX_PATH", os.path.join(_tmp, "search_index.json"))
+os.environ.setdefault("VALUE_SERIES_DIR", os.path.join(_tmp, "value_series"))
+
+import httpx
+import numpy as np
+import yfinance as yf
+import main
+from cache import TTLCache
+from search_index import SearchIndex
+from fakes import FakeSupabase, FakeMarket, rss_transport
+
+UNIVERSE = ["AAPL", "MSFT", "NVDA", "AMZN", "GOOGL", "META", "TSLA", "BRK-B", "JPM", "V", "JNJ", "WMT", "PG", "XOM", "KO",
+            "VWCE.DE", "IWDA.AS", "SXR8.DE", "EUNL.DE", "ASML.AS", "SAP.DE", "MC.PA", "SAN.MC", "ITX.MC", "IBE.MC",
+            "BTC-USD", "ETH-USD", "SOL-USD", "NESN.SW", "NOVO-B.CO"]
+
+# --- DATOS Y UPSTREAMS ---
+def seed(db: FakeSupabase, users: int, portfolios: int, assets: int, history: int, rng: random.Random):
+    db.tables["assets"] = [{"id": f"a{i}", "ticker": t, "name": f"{t} Corp", "type": "Stock", "sector": "Technology", "country": "Global",
+                            "currency": "EUR" if "." in t else "USD"} for i, t in enumerate(UNIVERSE)]
+    db.tables["portfolios"], db.tables["portfolio_items"] = [], []
+    db.tables["rebalance_history"], db.tables["rebalance_history_items"] = [], []
+    for u in range(users):
+        for p in range(portfolios):
+            pid = f"u{u}-p{p}"
+            db.tables["portfolios"].append({"id": pid, "user_id": f"u{u}", "name": f"Cartera {p}", "created_at": db.now(), "last_contribution": 500})
+            chosen = rng.sample(range(len(UNIVERSE)), min(assets, len(UNIVERSE)))
+            weights = np.random.default_rng(rng.randrange(2 ** 32)).dirichlet(np.ones(len(chosen))) * 100
+            for k, (a, w) in enumerate(zip(chosen, weights)):
+                db.tables["portfolio_items"].append({"id": f"{pid}-i{k}", "portfolio_id": pid, "asset_id": f"a{a}",
+                                                     "units_held": float(rng.randint(0, 40)), "target_weight": round(float(w), 2)})
+            for h in range(history):
+                hid = f"{pid}-h{h}"
+                db.tables["rebalance_history"].append({"id": hid, "portfolio_id": pid, "contribution": 500, "total_value_before": 10000, "created_at": db.now()})
+                db.tables["rebalance_history_items"].append({"id": f"{hid}-0", "history_id": hid, "asset_name": UNIVERSE[chosen[0]], "ticker": UNIVERSE[chosen[0]],
+                                                             "action": "BUY", "units": 1, "amount": 100, "price": 100})
+
+class Upstreams:
+    def __init__(self, db_latency: float, market_latency: float, rss_latency: float):
+        self.db = FakeSupabase(latency=db_latency)
+        self.market = FakeMarket(latency=market_latency)
+        self.rss = Counter()
+        main.supabase = main.instrument_supabase(self.db)
+        yf.download, yf.Ticker, yf.Search = self.market.download, self.market.Ticker, self.market.Search
+        main.feeds_http = httpx.AsyncClient(transport=rss_transport(rss_latency, self.rss), follow_redirects=True)
+
+    def counters(self) -> Counter:
+        c = Counter({"supabase": sum(self.db.calls.values()), "rss": self.rss["rss"]})
+        c.update({f"yf.{k}": v for k, v in self.market.calls.items()})
+        c["yf.tickers"] = self.market.tickers_requested
+        return c
+
+async def reset_caches():
+    """Deja la app como recién arrancada: cachés en memoria, estado del proveedor de mercado y datos en disco."""
+    for value in vars(main).values():
+        if isinstance(value, TTLCache): value.clear()
+    main.asset_ids.clear()
+    market = main.market
+    with market._lock:
+        market._failures, market._opened_at, market._probing = 0, None, False
+        market._last.clear()
+    for root in (main.history_store.root, main.value_store.root):
+        shutil.rmtree(root, ignore_errors=True)
+        os.makedirs(root, exist_ok=True)
+    with main.value_store._lock: main.value_store._versions.clear()
+    # Índice de búsqueda como al arrancar: solo la tabla assets, sin resultados de Yahoo de escenarios anteriores
+    if os.path.exists(main.SEARCH_INDEX_PATH): os.remove(main.SEARCH_INDEX_PATH)
+    main.search_index = SearchIndex(main.SEARCH_INDEX_PATH, max_entries=main.SEARCH_INDEX_MAX)
+    await main.load_search_index()
+
+# --- SESIONES ---
+_TIMING = re.compile(r'([\w.]+);dur=[\d.]+;desc="(\d+) calls')
+
+def upstream_calls(response: httpx.Response) -> Counter:
+    """Llamadas a upstreams de una petición según su cabecera Server-Timing (ver metrics.MetricsMiddleware)."""
+    return Counter({k: int(n) for k, n in _TIMING.findall(response.headers.get("server-timing", ""))})
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.upstream = defaultdict(Counter)  # endpoint -> llamadas a cada upstream
+
+    async def call(self, client: httpx.AsyncClient, name: str, method: str, url: str, **kw):
+        t0 = time.perf_counter()
+        r = await client.request(method, url, **kw)
+        self.latencies[name].append(time.perf_counter() - t0)
+        if r.status_code >= 400: self.errors[name] += 1
+        self.upstream[name].update(upstream_calls(r))
+        return r
+
+def user_portfolios(db: FakeSupabase, user: str):
+    return [p["id"] for p in db.tables["portfolios"] if p["user_id"] == user]
+
+def portfolio_assets(db: FakeSupabase, pid: str):
+    by_id = {a["id"]: a for a in db.tables["assets"]}
+    return [by_id[i["asset_id"]] for i in db.tables["portfolio_items"] if i["portfolio_id"] == pid]
+
+async def dashboard(rec, client, db, user, rng):
+    # Lo que hace hoy el frontend: lista de carteras y después cada cartera y su historial
+    await rec.call(client, "GET /portfolios/list", "GET", "/portfolios/list", params={"user_id": user})
+    await asyncio.gather(*(rec.call(client, "GET /portfolio/{id}", "GET", f"/portfolio/{pid}") for pid in user_portfolios(db, user)))
+    pid = rng.choice(user_portfolios(db, user))
+    await rec.call(client, "GET /portfolio/history/{id}", "GET", f"/portfolio/history/{pid}")
+
+async def overview(rec, client, db, user, rng):
+    await rec.call(client, "GET /portfolios/overview", "GET", "/portfolios/overview", params={"user_id": user})
+
+async def rebalance(rec, client, db, user, rng):
+    pid = rng.choice(user_portfolios(db, user))
+    r = await rec.call(client, "POST /portfolio/rebalance", "POST", "/portfolio/rebalance", json={"portfolio_id": pid, "contribution": 500, "mode": "solver"})
+    orders = r.json().get("orders", [])
+    r = await rec.call(client, "POST /portfolio/apply_rebalance", "POST", "/portfolio/apply_rebalance", json={"portfolio_id": pid, "contribution": 500, "orders": orders})
+    history_id = r.json().get("history_id")
+    if history_id: await rec.call(client, "POST /portfolio/history/undo", "POST", "/portfolio/history/undo", json={"history_id": history_id})
+
+async def news(rec, client, db, user, rng):
+    pid = rng.choice(user_portfolios(db, user))
+    assets = [{"ticker": a["ticker"], "name": a["name"]} for a in portfolio_assets(db, pid)]
+    await rec.call(client, "POST /portfolio/news", "POST", "/portfolio/news", json={"assets": assets})
+
+async def simulation(rec, client, db, user, rng):
+    body = {"portfolio_ids": user_portfolios(db, user), "years": 20, "initial_capital": 10000, "monthly_contribution": 300,
+            "contribution_mode": "constant", "tax_rate": True, "paths": 5000}
+    await rec.call(client, "POST /simulations/run (montecarlo)", "POST", "/simulations/run", json={**body, "sim_type": "montecarlo"})
+    await rec.call(client, "POST /simulations/run (historical)", "POST", "/simulations/run", json={**body, "sim_type": "historical"})
+
+async def comparison(rec, client, db, user, rng):
+    # Vista comparativa: 2 rentabilidades x 2 volatilidades x 2 modos x 2 aportaciones x 3 plazos x con/sin impuestos
+    body = {"portfolio_ids": user_portfolios(db, user), "initial_capital": 10000, "annual_returns": [0.04, 0.07], "volatilities": [0.0, 0.15],
+            "contribution_modes": ["constant", "growing"], "monthly_contributions": [150, 300], "years": [10, 20, 30],
+            "tax_rate": [False, True], "growth_rate": 2, "paths": 2000}
+    await rec.call(client, "POST /simulations/batch", "POST", "/simulations/batch", json=body)
+
+async def chart(rec, client, db, user, rng):
+    pid = rng.choice(user_portfolios(db, user))
+    await rec.call(client, "POST /portfolio/history_chart", "POST", "/portfolio/history_chart", json={"portfolio_id": pid, "period": rng.choice(["5d", "1mo", "1y"])})
+
+async def search(rec, client, db, user, rng):
+    q = rng.choice(UNIVERSE)[:rng.randint(1, 3)]
+    await rec.call(client, "GET /assets/search", "GET", "/assets/search", params={"q": q})
+
+SCENARIOS = {"dashboard": dashboard, "overview": overview, "rebalance": rebalance, "news": news, "simulation": simulation, "comparison": comparison, "chart": chart, "search": search}
+
+async def run_scenario(name, upstreams, users, sessions, concurrency, seed_value):
+    await reset_caches()
+    rec, rng = Recorder(), random.Random(seed_value)
+    plan = [(f"u{rng.randrange(users)}", random.Random(rng.random())) for _ in range(sessions)]
+    sem = asyncio.Semaphore(concurrency)
+    before = upstreams.counters()
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def one(user, r):
+            async with sem: await SCENARIOS[name](rec, client, upstreams.db, user, r)
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one(u, r) for u, r in plan))
+        elapsed = time.perf_counter() - t0
+    used = upstreams.counters() - before
+    requests = sum(len(v) for v in rec.latencies.values())
+    endpoints = {}
+    for ep, lat in rec.latencies.items():
+        ms = np.array(lat) * 1000
+        endpoints[ep] = {"requests": len(lat), "errors": rec.errors[ep], "p50_ms": round(float(np.percentile(ms, 50)), 2),
+                         "p99_ms": round(float(np.percentile(ms, 99)), 2), "max_ms": round(float(ms.max()), 2),
+                         "upstream_per_request": {k: round(v / len(lat), 2) for k, v in sorted(rec.upstream[ep].items())}}
+    return {"scenario": name, "sessions": sessions, "requests": requests, "seconds": round(elapsed, 3),
+            "rps": round(requests / elapsed, 1) if elapsed > 0 else None, "endpoints": endpoints,
+            "upstream": dict(used), "upstream_per_request": {k: round(v / requests, 2) for k, v in used.items()} if requests else {}}
+
+def print_report(result):
+    print(f"\n== {result['scenario']}: {result['sessions']} sesiones, {result['requests']} peticiones en {result['seconds']} s ({result['rps']} req/s)")
+    print(f"   {'endpoint':<38} {'n':>5} {'err':>4} {'p50 ms':>9} {'p99 ms':>9}  upstream/req")
+    for ep, s in result["endpoints"].items():
+        per_req = " ".join(f"{k}={v}" for k, v in s["upstream_per_request"].items()) or "-"
+        print(f"   {ep:<38} {s['requests']:>5} {s['errors']:>4} {s['p50_ms']:>9.1f} {s['p99_ms']:>9.1f}  {per_req}")
+    calls = ", ".join(f"{k}={v} ({result['upstream_per_request'][k]}/req)" for k, v in sorted(result["upstream"].items()))
+    print(f"   upstream: {calls or '-'}")
+
+async def run(args):
+    upstreams = Upstreams(args.db_latency, args.market_latency, args.rss_latency)
+    seed(upstreams.db, args.users, args.portfolios, args.assets, args.history, random.Random(args.seed))
+    results = []
+    for name in args.scenarios.split(","):
+        result = await run_scenario(name.strip(), upstreams, args.users, args.sessions, args.concurrency, args.seed)
+        print_report(result)
+        results.append(result)
+    await main.feeds_http.aclose()
+    return results
+
+def main_cli():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--users", type=int, default=20)
+    ap.add_argument("--portfolios", type=int, default=3, help="carteras por usuario")
+    ap.add_argument("--assets", type=int, default=10, help="activos por cartera")
+    ap.add_argument("--history", type=int, default=20, help="entradas de historial por cartera")
+    ap.add_argument("--sessions", type=int, default=40, help="sesiones por escenario")
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--db-latency", type=float, default=0.02)
+    ap.add_argument("--market-latency", type=float, default=0.2)
+    ap.add_argument("--rss-latency", type=float, default=0.1)
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS))
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--json", help="guarda los resultados en este fichero")
+    args = ap.parse_args()
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w") as f: json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main_cli()
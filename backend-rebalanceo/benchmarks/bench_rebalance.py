@@ -0,0 +1,64 @@
+"""Solver de rebalanceo frente a la propuesta ingenua de /portfolio/rebalance.
+
+Carteras sintéticas de distintos tamaños; para cada una se compara el tracking error final y el tiempo de:
+  - naive: diferencias a objetivo en unidades fraccionarias con ventas (lo que propone hoy el endpoint)
+  - naive ejecutable: la misma propuesta sin ventas, escalada a la aportación y redondeada a unidades enteras
+  - solver: solve_rebalance con unidades enteras, sin ventas, orden mínima y comisiones
+
+La aportación es un porcentaje del valor de cada cartera.
+
+Uso: python benchmarks/bench_rebalance.py [--runs 200] [--contribution-pct 10]
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rebalance_solver import solve_rebalance, tracking_error
+
+def naive(values, prices, weights, contribution):
+    future = values.sum() + contribution
+    diff = future * weights / 100 - values
+    return diff / prices
+
+def naive_executable(values, prices, weights, contribution, fee_fixed, fee_rate):
+    buys = np.clip(naive(values, prices, weights, contribution), 0, None) * prices
+    budget = contribution / (1 + fee_rate) - fee_fixed * np.count_nonzero(buys)
+    if buys.sum() > budget > 0: buys *= budget / buys.sum()
+    return np.floor(buys / prices)
+
+def timed(fn, runs):
+    t0 = time.perf_counter()
+    for _ in range(runs): out = fn()
+    return out, (time.perf_counter() - t0) / runs * 1000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=200)
+    ap.add_argument("--contribution-pct", type=float, default=10.0)
+    ap.add_argument("--min-order", type=float, default=50.0)
+    ap.add_argument("--fee-fixed", type=float, default=1.0)
+    ap.add_argument("--fee-rate", type=float, default=0.001)
+    ap.add_argument("--seed", type=int, default=7)
+    args = ap.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    print(f"{'assets':>6} | {'TE inicial':>10} | {'TE naive':>8} | {'TE naive ejec.':>14} | {'TE solver':>9} | {'ms naive':>8} | {'ms solver':>9}")
+    for n in (5, 20, 100, 250):
+        prices = rng.lognormal(4, 1, n)
+        values = rng.integers(0, 50, n) * prices
+        weights = rng.dirichlet(np.ones(n)) * 100
+        c = values.sum() * args.contribution_pct / 100
+
+        units_naive, ms_naive = timed(lambda: naive(values, prices, weights, c), args.runs)
+        units_exec = naive_executable(values, prices, weights, c, args.fee_fixed, args.fee_rate)
+        sol, ms_solver = timed(lambda: solve_rebalance(values, prices, weights, c, min_order=args.min_order,
+                                                       fee_fixed=args.fee_fixed, fee_rate=args.fee_rate), args.runs)
+        te = [tracking_error(values, weights), tracking_error(values + units_naive * prices, weights),
+              tracking_error(values + units_exec * prices, weights), sol["tracking_error"]]
+        print(f"{n:>6} | {te[0]:>10.3f} | {te[1]:>8.3f} | {te[2]:>14.3f} | {te[3]:>9.3f} | {ms_naive:>8.3f} | {ms_solver:>9.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""Dobles locales de los upstreams de main.py para los benchmarks: Supabase en memoria, yfinance y feeds RSS.
+
+Todos cuentan sus llamadas (`calls`) y admiten una latencia fija por llamada para simular la red.
+"""
+import re
+import time
+import copy
+import uuid
+import asyncio
+import datetime
+import itertools
+from collections import Counter
+import httpx
+import numpy as np
+import pandas as pd
+
+# --- SUPABASE EN MEMORIA ---
+# (tabla, recurso embebido) -> (columna FK, cardinalidad)
+RELATIONS = {
+    ("portfolio_items", "assets"): ("asset_id", "one"),
+    ("portfolio_items", "portfolios"): ("portfolio_id", "one"),
+    ("portfolios", "portfolio_items"): ("portfolio_id", "many"),
+    ("portfolios", "rebalance_history"): ("portfolio_id", "many"),
+    ("rebalance_history", "rebalance_history_items"): ("history_id", "many"),
+}
+
+class APIError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+class _Result:
+    def __init__(self, data):
+        self.data = data
+
+def _split_top(text: str) -> list:
+    """Trozos separados por comas fuera de paréntesis."""
+    parts, depth, cur = [], 0, ""
+    for ch in text:
+        if ch == "," and depth == 0:
+            parts.append(cur.strip()); cur = ""; continue
+        depth += (ch == "(") - (ch == ")")
+        cur += ch
+    if cur.strip(): parts.append(cur.strip())
+    return parts
+
+def _split_select(cols: str):
+    """'a, b:tabla(x, y(z))' -> [(alias, tabla o None, subselect o None)]."""
+    out = []
+    for p in _split_top(cols):
+        m = re.match(r"(\w+)(?::(\w+))?(?:!\w+)?\((.*)\)$", p, re.S)
+        out.append((m.group(1), m.group(2) or m.group(1), m.group(3)) if m else (p, None, None))
+    return out
+
+_OPS = {"eq": lambda x, v: str(x) == v, "neq": lambda x, v: str(x) != v, "gt": lambda x, v: x is not None and str(x) > v,
+        "gte": lambda x, v: x is not None and str(x) >= v, "lt": lambda x, v: x is not None and str(x) < v,
+        "lte": lambda x, v: x is not None and str(x) <= v}
+
+def _logic(expr: str, combine):
+    preds = []
+    for t in _split_top(expr):
+        m = re.match(r"(and|or)\((.*)\)$", t, re.S)
+        if m:
+            preds.append(_logic(m.group(2), all if m.group(1) == "and" else any))
+            continue
+        col, op, val = t.split(".", 2)
+        val = val[1:-1] if val.startswith('"') and val.endswith('"') else val
+        preds.append(lambda row, col=col, op=op, val=val: _OPS[op](row.get(col), val))
+    return lambda row: combine(p(row) for p in preds)
+
+class FakeQuery:
+    def __init__(self, db, table):
+        self.db, self.table = db, table
+        self.op, self.cols, self.payload = "select", "*", None
+        self.filters, self.orders, self._limit, self._offset, self.embed_opts = [], [], None, 0, {}
+
+    def select(self, cols="*", **kw): self.op, self.cols = "select", cols; return self
+    def insert(self, payload, **kw): self.op, self.payload = "insert", payload; return self
+    def upsert(self, payload, **kw): self.op, self.payload = "upsert", payload; return self
+    def update(self, payload, **kw): self.op, self.payload = "update", payload; return self
+    def delete(self, **kw): self.op = "delete"; return self
+
+    def _filter(self, col, fn): self.filters.append((col, fn)); return self
+    def eq(self, c, v): return self._filter(c, lambda x: str(x) == str(v))
+    def neq(self, c, v): return self._filter(c, lambda x: str(x) != str(v))
+    def gt(self, c, v): return self._filter(c, lambda x: x is not None and x > v)
+    def gte(self, c, v): return self._filter(c, lambda x: x is not None and x >= v)
+    def lt(self, c, v): return self._filter(c, lambda x: x is not None and x < v)
+    def lte(self, c, v): return self._filter(c, lambda x: x is not None and x <= v)
+    def or_(self, expr, **kw):
+        """Filtro lógico de PostgREST: 'a.lt.x,and(a.eq.x,b.lt.y)' (operadores de comparación y and/or anidados)."""
+        return self._filter(None, _logic(expr, any))
+    def in_(self, c, values):
+        allowed = {str(v) for v in values}
+        return self._filter(c, lambda x: str(x) in allowed)
+
+    def order(self, col, desc=False, foreign_table=None, **kw):
+        if foreign_table: self.embed_opts.setdefault(foreign_table, {})["order"] = (col, desc)
+        else: self.orders.append((col, desc))
+        return self
+
+    def limit(self, n, foreign_table=None, **kw):
+        if foreign_table: self.embed_opts.setdefault(foreign_table, {})["limit"] = n
+        else: self._limit = n
+        return self
+
+    def range(self, start, end, foreign_table=None, **kw):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def _project(self, table, row, cols):
+        out = {}
+        for alias, embedded, sub in _split_select(cols):
+            if embedded is None:
+                if alias == "*": out.update(copy.deepcopy(row))
+                else: out[alias] = copy.deepcopy(row.get(alias))
+                continue
+            fk, kind = RELATIONS[(table, embedded)]
+            rows = self.db.tables.get(embedded, [])
+            if kind == "one":
+                parent = next((r for r in rows if r["id"] == row.get(fk)), None)
+                out[alias] = self._project(embedded, parent, sub) if parent else None
+                continue
+            kids = [r for r in rows if r.get(fk) == row["id"]]
+            opts = self.embed_opts.get(alias) or self.embed_opts.get(embedded) or {}
+            if "order" in opts:
+                col, desc = opts["order"]
+                kids.sort(key=lambda r: r.get(col) or "", reverse=desc)
+            if "limit" in opts: kids = kids[:opts["limit"]]
+            out[alias] = [self._project(embedded, k, sub) for k in kids]
+        return out
+
+    def _run(self):
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.op in ("insert", "upsert"):
+            payload = self.payload if isinstance(self.payload, list) else [self.payload]
+            out = []
+            for r in payload:
+                existing = next((x for x in rows if "id" in r and x["id"] == r["id"]), None) if self.op == "upsert" else None
+                if existing is not None:
+                    existing.update(r); out.append(copy.deepcopy(existing)); continue
+                r = {"id": str(uuid.uuid4()), "created_at": self.db.now(), **r}
+                rows.append(r); out.append(copy.deepcopy(r))
+            return out
+        matched = [r for r in rows if all(fn(r) if c is None else fn(r.get(c)) for c, fn in self.filters)]
+        if self.op == "update":
+            for r in matched: r.update(self.payload)
+            return copy.deepcopy(matched)
+        if self.op == "delete":
+            ids = {id(r) for r in matched}
+            self.db.tables[self.table] = [r for r in rows if id(r) not in ids]
+            self.db.cascade(self.table, {r["id"] for r in matched})
+            return copy.deepcopy(matched)
+        for col, desc in reversed(self.orders): matched.sort(key=lambda r: r.get(col) or "", reverse=desc)
+        matched = matched[self._offset:]
+        if self._limit is not None: matched = matched[:self._limit]
+        return [self._project(self.table, r, self.cols) for r in matched]
+
+    async def execute(self):
+        self.db.calls[f"{self.op} {self.table}"] += 1
+        if self.db.latency: await asyncio.sleep(self.db.latency)
+        return _Result(self._run())
+
+class FakeRPC:
+    def __init__(self, db, fn, params):
+        self.db, self.fn, self.params = db, fn, params
+
+    async def execute(self):
+        self.db.calls[f"rpc {self.fn}"] += 1
+        if self.db.latency: await asyncio.sleep(self.db.latency)
+        if self.fn not in self.db.rpcs: raise APIError("PGRST202", f"Could not find the function {self.fn}")
+        return _Result(self.db.rpcs[self.fn](self.db, self.params))
+
+class FakeSupabase:
+    """Cliente asíncrono en memoria con la parte de la API de supabase-py que usa main.py.
+
+    Sin funciones RPC registradas responde como PostgREST (PGRST202) y main.py usa su ruta alternativa.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.tables = {}
+        self.rpcs = {}
+        self.calls = Counter()
+        self._clock = itertools.count()
+
+    def now(self) -> str:
+        return (datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=next(self._clock))).isoformat()
+
+    def table(self, name): return FakeQuery(self, name)
+    def rpc(self, fn, params=None): return FakeRPC(self, fn, params or {})
+
+    def cascade(self, table, ids):
+        # ON DELETE CASCADE de las relaciones uno-a-muchos
+        for (parent, child), (fk, kind) in RELATIONS.items():
+            if parent == table and kind == "many":
+                self.tables[child] = [r for r in self.tables.get(child, []) if r.get(fk) not in ids]
+
+# --- YFINANCE ---
+_PERIOD_DAYS = {"d": 1, "wk": 7, "mo": 31, "y": 365}
+
+def _period_days(period: str) -> int:
+    if period in (None, "max"): return 3650
+    if period == "ytd": return datetime.date.today().timetuple().tm_yday
+    m = re.match(r"(\d+)(d|wk|mo|y)$", period)
+    return int(m.group(1)) * _PERIOD_DAYS[m.group(2)] if m else 365
+
+class FakeMarket:
+    """yf.download / yf.Ticker / yf.Search deterministas (paseo aleatorio por ticker) con latencia por llamada."""
+
+    def __init__(self, latency: float = 0.0, failing=()):
+        self.latency = latency
+        self.failing = set(failing)  # tickers que el lote no devuelve (fuerza la ruta de fallback)
+        self.calls = Counter()
+        self.tickers_requested = 0
+
+    def _sleep(self):
+        if self.latency: time.sleep(self.latency)
+
+    def _index(self, interval, period=None, start=None):
+        end = pd.Timestamp.now().normalize()
+        if start is not None: begin = pd.Timestamp(start).normalize()
+        else: begin = end - pd.Timedelta(days=_period_days(period))
+        if interval == "1d": return pd.bdate_range(begin, end)
+        freq = {"15m": "15min", "1h": "h"}.get(interval, "h")
+        idx = pd.date_range(begin, end + pd.Timedelta(days=1), freq=freq, tz="UTC")
+        return idx[(idx.hour >= 14) & (idx.hour < 21) & (idx.dayofweek < 5)]
+
+    @staticmethod
+    def _walk(ticker, n):
+        rng = np.random.default_rng(abs(hash(ticker)) % (2 ** 32))
+        start = rng.uniform(20, 400)
+        return start * np.exp(np.cumsum(rng.normal(0.0003, 0.015, n)))
+
+    def download(self, tickers, period=None, interval="1d", start=None, **kw):
+        self.calls["download"] += 1
+        tickers = [tickers] if isinstance(tickers, str) else list(tickers)
+        self.tickers_requested += len(tickers)
+        self._sleep()
+        idx = self._index(interval, period, start)
+        cols = {}
+        for t in tickers:
+            if t in self.failing: continue
+            close = self._walk(t, len(idx))
+            for field, values in (("Open", close * 0.998), ("High", close * 1.01), ("Low", close * 0.99), ("Close", close), ("Volume", np.full(len(idx), 1e6))):
+                cols[(field, t)] = values
+        if not cols: return pd.DataFrame()
+        df = pd.DataFrame(cols, index=idx)
+        df.columns = pd.MultiIndex.from_tuples(df.columns, names=["Price", "Ticker"])
+        return df
+
+    def Ticker(self, ticker):
+        self.calls["Ticker"] += 1
+        market = self
+
+        class _FastInfo:
+            @property
+            def last_price(self):
+                market._sleep()
+                return float(market._walk(ticker, 1)[-1])
+
+        class _Ticker:
+            fast_info = _FastInfo()
+
+            @property
+            def info(self):
+                market.calls["info"] += 1
+                market._sleep()
+                currency = "EUR" if "." in ticker else "USD"
+                return {"longName": f"{ticker} Corp", "quoteType": "EQUITY", "sector": "Technology", "country": "United States", "currency": currency}
+
+            def history(self, period="1d", **kw):
+                market._sleep()
+                return market.download([ticker], period=period).xs(ticker, axis=1, level=1)
+
+        return _Ticker()
+
+    def Search(self, q, max_results=8, **kw):
+        self.calls["Search"] += 1
+        self._sleep()
+
+        class _Search:
+            quotes = [{"symbol": f"{q.upper()}{i or ''}", "shortname": f"{q.title()} {i}", "quoteType": "EQUITY", "exchange": "NMS"} for i in range(max_results)]
+        return _Search()
+
+# --- RSS ---
+def rss_transport(latency: float = 0.0, calls: Counter = None) -> httpx.AsyncBaseTransport:
+    """Transporte httpx que responde a cualquier URL con un feed RSS de 5 entradas."""
+    calls = calls if calls is not None else Counter()
+
+    async def handler(request: httpx.Request):
+        calls["rss"] += 1
+        if latency: await asyncio.sleep(latency)
+        items = "".join(
+            f"<item><title>Noticia {i}</title><link>https://example.com/{i}</link><pubDate>Mon, 0{i + 1} Jan 2024 10:00:00 GMT</pubDate><source url=\"https://example.com\">Fuente</source></item>"
+            for i in range(5)
+        )
+        body = f"<?xml version=\"1.0\"?><rss version=\"2.0\"><channel><title>Fake</title>{items}</channel></rss>"
+        return httpx.Response(200, content=body.encode(), headers={"content-type": "application/rss+xml"})
+
+    return httpx.MockTransport(handler)
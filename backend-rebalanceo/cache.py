@@ -0,0 +1,144 @@
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+_MISSING = object()
+
+class TTLCache:
+    """Caché en memoria con TTL, expulsión LRU y deduplicación de cargas concurrentes (single-flight).
+
+    Es thread-safe: varias peticiones que piden la misma clave a la vez comparten una sola carga.
+    `aget_or_load` ofrece lo mismo para loaders asíncronos dentro del event loop.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0, name: str = "cache"):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._inflight = {}  # key -> Future
+        self._atasks = {}  # key -> asyncio.Task
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _get_locked(self, key, now):
+        entry = self._data.get(key)
+        if entry is None: return _MISSING
+        if entry[0] <= now:
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def _set_locked(self, key, value, ttl):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get_locked(key, time.monotonic())
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        with self._lock: self._set_locked(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock: self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock: self._data.clear()
+
+    def get_many(self, keys, loader, ttl: float = None) -> dict:
+        """Devuelve {key: value} para las claves encontradas.
+
+        Los fallos se piden todos juntos en una sola llamada a `loader(missing_keys) -> dict`.
+        Las claves que ya está cargando otro hilo no se vuelven a pedir: se espera a su resultado.
+        Las claves que el loader no devuelve no se cachean (se reintentan en la siguiente llamada).
+        """
+        result, claimed, waiting = {}, [], {}
+        now = time.monotonic()
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                value = self._get_locked(key, now)
+                if value is not _MISSING:
+                    self.hits += 1
+                    result[key] = value
+                    continue
+                self.misses += 1
+                fut = self._inflight.get(key)
+                if fut is not None:
+                    self.coalesced += 1
+                    waiting[key] = fut
+                else:
+                    self._inflight[key] = Future()
+                    claimed.append(key)
+
+        if claimed:
+            try:
+                loaded = loader(claimed) or {}
+            except BaseException as e:
+                with self._lock:
+                    for key in claimed: self._inflight.pop(key).set_exception(e)
+                raise
+            with self._lock:
+                for key in claimed:
+                    fut = self._inflight.pop(key)
+                    if key in loaded:
+                        self._set_locked(key, loaded[key], ttl)
+                        result[key] = loaded[key]
+                    fut.set_result(loaded.get(key, _MISSING))
+
+        for key, fut in waiting.items():
+            try: value = fut.result()
+            except Exception: continue
+            if value is not _MISSING: result[key] = value
+        return result
+
+    def get_or_load(self, key, loader, ttl: float = None, default=None):
+        """Versión de una sola clave de `get_many`: `loader(key) -> value`."""
+        return self.get_many([key], lambda ks: {key: loader(key)}, ttl).get(key, default)
+
+    async def aget_or_load(self, key, loader, ttl: float = None, default=None):
+        """`await loader(key)` con single-flight entre corrutinas. None o una excepción no se cachean y devuelven `default`."""
+        value = self.get(key, _MISSING)
+        if value is not _MISSING: return value
+        task = self._atasks.get(key)
+        if task is None:
+            task = self._atasks[key] = asyncio.ensure_future(self._aload(key, loader, ttl))
+        else:
+            with self._lock: self.coalesced += 1
+        try: value = await asyncio.shield(task)
+        except Exception: return default
+        return default if value is None else value
+
+    async def _aload(self, key, loader, ttl):
+        try:
+            value = await loader(key)
+            if value is not None: self.set(key, value, ttl)
+            return value
+        finally:
+            self._atasks.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name, "size": len(self._data), "maxsize": self.maxsize, "ttl": self.ttl,
+                "hits": self.hits, "misses": self.misses, "coalesced": self.coalesced, "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
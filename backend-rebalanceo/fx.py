@@ -0,0 +1,26 @@
+from typing import Dict, Iterable, List, Tuple
+
+# Yahoo cotiza algunos mercados en subunidades (peniques en Londres, céntimos en Johannesburgo, agorot en Tel Aviv)
+MINOR_UNITS = {"GBp": ("GBP", 0.01), "GBX": ("GBP", 0.01), "ZAc": ("ZAR", 0.01), "ZAC": ("ZAR", 0.01), "ILA": ("ILS", 0.01)}
+
+def split_currency(currency: str, default: str) -> Tuple[str, float]:
+    """Divisa de cotización -> (código ISO, factor a la unidad principal). Ojo: 'GBp' y 'GBP' son distintas."""
+    if not currency: return default, 1.0
+    if currency in MINOR_UNITS: return MINOR_UNITS[currency]
+    return currency.upper(), 1.0
+
+def fx_ticker(currency: str, base: str) -> str:
+    """Ticker de Yahoo con el precio de 1 unidad de `currency` en `base` (p. ej. USDEUR=X), o None si coinciden."""
+    iso, _ = split_currency(currency, base)
+    return None if iso == base else f"{iso}{base}=X"
+
+def fx_tickers(pairs: Iterable[Tuple[str, str]]) -> List[str]:
+    """Tickers de tipo de cambio (sin repetir) para pares (divisa del activo, divisa base)."""
+    return [t for t in dict.fromkeys(fx_ticker(c, b) for c, b in pairs) if t]
+
+def conversion_factor(currency: str, base: str, prices: Dict[str, float]) -> float:
+    """Multiplicador de la cotización en `currency` a `base`; 0.0 si falta el tipo de cambio (como una cotización ausente)."""
+    iso, factor = split_currency(currency, base)
+    if iso == base: return factor
+    rate = prices.get(f"{iso}{base}=X") or 0.0
+    return factor * rate if rate > 0 else 0.0
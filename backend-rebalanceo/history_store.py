@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+import urllib.parse
+import numpy as np
+import pandas as pd
+
+# Una barra OHLCV; ts en segundos epoch (hora UTC en intradía, fecha local de mercado en diario)
+BAR_DTYPE = np.dtype([("ts", "<i8"), ("open", "<f8"), ("high", "<f8"), ("low", "<f8"), ("close", "<f8"), ("volume", "<f8")])
+
+# Rango máximo que sirve Yahoo por intervalo (primera descarga de un ticker) y límite para `start`
+MAX_RANGE = {"15m": "60d", "1h": "730d", "1d": "max"}
+MAX_START_AGE = {"15m": 59 * 86400, "1h": 729 * 86400}
+# Cada cuánto se vuelve a pedir la cola de una serie
+DEFAULT_REFRESH = {"15m": 300, "1h": 900, "1d": 3600}
+
+def to_epoch(index: pd.DatetimeIndex, interval: str) -> np.ndarray:
+    if index.tz is not None:
+        index = index.tz_convert("UTC").tz_localize(None) if interval != "1d" else index.tz_localize(None)
+    return ((index - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+
+def frame_to_bars(df: pd.DataFrame, interval: str) -> np.ndarray:
+    """DataFrame con columnas Open/High/Low/Close/Volume de un ticker -> array de BAR_DTYPE."""
+    df = df.dropna(subset=["Close"])
+    bars = np.empty(len(df), dtype=BAR_DTYPE)
+    bars["ts"] = to_epoch(df.index, interval)
+    for col in ("open", "high", "low", "close", "volume"):
+        src = col.capitalize()
+        bars[col] = df[src].to_numpy(dtype=np.float64) if src in df.columns else np.nan
+    return bars
+
+class HistoryStore:
+    """Histórico de barras en disco: un .npy (array estructurado, leído con mmap) por ticker e intervalo.
+
+    `sync` solo descarga la cola que falta desde la última barra guardada, en una llamada por lote de tickers.
+    Cada serie caducada la descarga un solo hilo a la vez y sin locks tomados durante la descarga: quien pide
+    otros tickers no espera, y quien pide la misma solo espera si aún no hay nada guardado.
+    """
+
+    def __init__(self, root: str, refresh: dict = None):
+        self.root = root
+        self.refresh = {**DEFAULT_REFRESH, **(refresh or {})}
+        self._inflight = {}  # (intervalo, ticker) -> Event del hilo que la está descargando
+        self._guard = threading.Lock()
+        self.downloads = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, ticker: str, interval: str) -> str:
+        return os.path.join(self.root, interval, urllib.parse.quote(ticker, safe="") + ".npy")
+
+    def load(self, ticker: str, interval: str):
+        path = self._path(ticker, interval)
+        if not os.path.exists(path): return None
+        try: return np.load(path, mmap_mode="r")
+        except (ValueError, OSError): return None
+
+    def is_fresh(self, ticker: str, interval: str) -> bool:
+        try: return time.time() - os.path.getmtime(self._path(ticker, interval)) < self.refresh.get(interval, 3600)
+        except OSError: return False
+
+    def write(self, ticker: str, interval: str, bars: np.ndarray):
+        """Fusiona `bars` con lo guardado (las barras nuevas sustituyen desde su primera fecha) y guarda de forma atómica."""
+        path = self._path(ticker, interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        old = self.load(ticker, interval)
+        bars = np.sort(bars, order="ts")
+        if old is not None and len(old):
+            keep = old[old["ts"] < bars["ts"][0]] if len(bars) else old
+            bars = np.concatenate([np.asarray(keep), bars])
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f: np.save(f, bars)
+        os.replace(tmp, path)
+
+    def sync(self, tickers, interval: str, fetch):
+        """Pone al día las series. `fetch(tickers, interval, start) -> {ticker: bars}`; start=None pide el rango máximo.
+
+        Si `fetch` devuelve None (error del upstream) no se escribe nada: las series siguen caducadas y se reintentan.
+        """
+        if not any(not self.is_fresh(t, interval) for t in tickers): return
+        # Se reservan las caducadas que nadie está descargando; de las que ya baja otro hilo solo se espera
+        # a las que aún no tienen nada en disco (las demás se sirven algo desfasadas)
+        mine, others = [], []
+        with self._guard:
+            for t in dict.fromkeys(tickers):
+                if self.is_fresh(t, interval): continue
+                event = self._inflight.get((interval, t))
+                if event is None:
+                    self._inflight[(interval, t)] = threading.Event()
+                    mine.append(t)
+                elif not os.path.exists(self._path(t, interval)): others.append(event)
+        try:
+            if mine: self._download(mine, interval, fetch)
+        finally:
+            with self._guard:
+                for t in mine: self._inflight.pop((interval, t)).set()
+        for event in others: event.wait()
+
+    def _download(self, stale, interval: str, fetch):
+        # Sin locks: solo este hilo escribe estas series hasta que se liberan en sync
+        stored = {t: self.load(t, interval) for t in stale}
+        new = [t for t in stale if stored[t] is None or not len(stored[t])]
+        known = [t for t in stale if t not in new]
+        batches = []
+        if new: batches.append((new, None))
+        if known:
+            start = int(min(stored[t]["ts"][-1] for t in known))
+            # Margen de un día para cubrir barras parciales y desfases de zona horaria
+            if interval != "1d": start -= 86400
+            if interval in MAX_START_AGE and time.time() - start > MAX_START_AGE[interval]: start = None
+            batches.append((known, start))
+        for group, start in batches:
+            with self._guard: self.downloads += 1
+            got = fetch(group, interval, start)
+            if got is None: continue
+            for t in group:
+                bars = got.get(t)
+                if bars is not None and len(bars): self.write(t, interval, bars)
+                elif stored.get(t) is None: self.write(t, interval, np.empty(0, dtype=BAR_DTYPE))
+                else: os.utime(self._path(t, interval))
+
+    def closes(self, tickers, interval: str, start=None) -> pd.DataFrame:
+        """Cierres de varios tickers como DataFrame (índice datetime sin zona, una columna por ticker)."""
+        cols = {}
+        for t in tickers:
+            bars = self.load(t, interval)
+            if bars is None or not len(bars): continue
+            if start is not None:
+                bars = bars[bars["ts"] >= int((pd.Timestamp(start) - pd.Timestamp(0)) // pd.Timedelta(seconds=1))]
+            cols[t] = pd.Series(np.asarray(bars["close"]), index=pd.to_datetime(np.asarray(bars["ts"]), unit="s"))
+        if not cols: return pd.DataFrame()
+        return pd.DataFrame(cols).sort_index()
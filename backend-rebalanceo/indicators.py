@@ -0,0 +1,152 @@
+import copy
+import numpy as np
+import pandas as pd
+
+TRADING_DAYS = 252
+
+def price_matrix(df: pd.DataFrame):
+    """DataFrame de cierres (columnas = tickers) -> (tickers, matriz T x N float64, nº de observaciones reales por columna).
+
+    Cada columna usa solo sus propias sesiones, alineadas por el final: la fila k es la k-ésima sesión de cada
+    ticker empezando por la última, no una fecha común. Así un ticker no recibe filas de rentabilidad cero en los
+    días en que solo cotiza otro del lote (fines de semana de cripto, festivos de otra bolsa) y sus indicadores no
+    dependen de con quién se calculen. Antes de la primera cotización se asume precio constante.
+    """
+    df = df.sort_index()
+    cols = [df[c].dropna().to_numpy(dtype=np.float64) for c in df.columns]
+    counts = np.array([len(c) for c in cols], dtype=np.int64)
+    values = np.full((int(counts.max()) if len(cols) else 0, len(cols)), np.nan)
+    for j, col in enumerate(cols):
+        if not len(col): continue
+        values[len(values) - len(col):, j] = col
+        values[:len(values) - len(col), j] = col[0]
+    return list(df.columns), values, counts
+
+class Indicators:
+    """Indicadores técnicos para N tickers a la vez (una columna por ticker).
+
+    Se construye con una pasada vectorizada sobre la matriz de precios completa y después se
+    actualiza barra a barra en O(N) con `update`, sin recalcular la ventana.
+    Incluye RSI de Wilder, medias móviles simples, volatilidad anualizada y drawdown.
+    """
+
+    def __init__(self, tickers, prices: np.ndarray, counts=None, rsi_period: int = 14, sma_windows=(20, 50), vol_window: int = 20):
+        prices = np.atleast_2d(np.asarray(prices, dtype=np.float64))
+        self.tickers = list(tickers)
+        self.rsi_period = rsi_period
+        self.sma_windows = tuple(sma_windows)
+        self.vol_window = vol_window
+        T, N = prices.shape
+        self.n = np.full(N, T) if counts is None else np.asarray(counts, dtype=np.int64).copy()
+
+        # RSI de Wilder: media simple de las primeras `p` variaciones y después suavizado exponencial
+        # avg_T = (1-a)^(T-p) * seed + sum_k a*(1-a)^(T-k) * x_k, como un único producto matriz-vector
+        p = rsi_period
+        delta = np.diff(prices, axis=0)
+        gains, losses = np.clip(delta, 0, None), np.clip(-delta, 0, None)
+        if len(delta) >= p:
+            a = 1.0 / p
+            rest = len(delta) - p
+            w = a * (1 - a) ** np.arange(rest - 1, -1, -1)
+            decay = (1 - a) ** rest
+            self.avg_gain = decay * gains[:p].mean(axis=0) + w @ gains[p:]
+            self.avg_loss = decay * losses[:p].mean(axis=0) + w @ losses[p:]
+        else:
+            self.avg_gain = np.full(N, np.nan)
+            self.avg_loss = np.full(N, np.nan)
+        self._rsi_obs = len(delta)
+
+        # Ventanas circulares de cierres y rentabilidades para medias y volatilidad
+        self._W = max(self.sma_windows)
+        self._closes = np.full((self._W, N), np.nan)
+        k = min(T, self._W)
+        self._closes[self._W - k:] = prices[T - k:]
+        self._pos = 0  # índice del cierre más antiguo en el buffer
+        self._sma_sums = {w: prices[T - min(T, w):].sum(axis=0) for w in self.sma_windows}
+
+        rets = np.diff(np.log(prices), axis=0) if T > 1 else np.empty((0, N))
+        self._rets = np.zeros((vol_window, N))
+        k = min(len(rets), vol_window)
+        if k: self._rets[vol_window - k:] = rets[len(rets) - k:]
+        self._rpos = 0
+        self._ret_obs = len(rets)
+        self._r_sum = self._rets.sum(axis=0)
+        self._r_sq = (self._rets ** 2).sum(axis=0)
+
+        self.peak = np.maximum.accumulate(prices, axis=0)[-1] if T else np.full(N, np.nan)
+        self.max_drawdown = (prices / np.maximum.accumulate(prices, axis=0) - 1).min(axis=0) if T else np.zeros(N)
+        self.last = prices[-1] if T else np.full(N, np.nan)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, **kwargs):
+        tickers, values, counts = price_matrix(df)
+        return cls(tickers, values, counts, **kwargs)
+
+    def update(self, new_prices):
+        """Añade una barra nueva (un precio por ticker, en el mismo orden) en O(N)."""
+        new = np.asarray(new_prices, dtype=np.float64)
+        new = np.where(np.isfinite(new) & (new > 0), new, self.last)
+        delta = new - self.last
+
+        p = self.rsi_period
+        gain, loss = np.clip(delta, 0, None), np.clip(-delta, 0, None)
+        if self._rsi_obs >= p:
+            self.avg_gain = (self.avg_gain * (p - 1) + gain) / p
+            self.avg_loss = (self.avg_loss * (p - 1) + loss) / p
+        self._rsi_obs += 1
+
+        oldest = self._pos
+        for w in self.sma_windows:
+            drop = self._closes[(oldest + self._W - w) % self._W]
+            self._sma_sums[w] += new - np.nan_to_num(drop)
+        self._closes[oldest] = new
+        self._pos = (oldest + 1) % self._W
+
+        r = np.log(new / self.last)
+        old_r = self._rets[self._rpos]
+        self._r_sum += r - old_r
+        self._r_sq += r ** 2 - old_r ** 2
+        self._rets[self._rpos] = r
+        self._rpos = (self._rpos + 1) % self.vol_window
+        self._ret_obs += 1
+
+        self.peak = np.maximum(self.peak, new)
+        self.max_drawdown = np.minimum(self.max_drawdown, new / self.peak - 1)
+        self.last = new
+        self.n = self.n + 1
+        return self
+
+    def preview(self, new_prices) -> dict:
+        """Snapshot como si se añadiera `new_prices` (p. ej. la cotización en vivo), sin modificar el estado."""
+        return copy.deepcopy(self).update(new_prices).snapshot()
+
+    def rsi(self) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = 100 - 100 / (1 + self.avg_gain / self.avg_loss)
+        rsi = np.where(self.avg_loss == 0, np.where(self.avg_gain > 0, 100.0, 50.0), rsi)
+        return np.where(self.n > self.rsi_period, rsi, np.nan)
+
+    def sma(self, window: int) -> np.ndarray:
+        sma = self._sma_sums[window] / window
+        return np.where(self.n >= window, sma, np.nan)
+
+    def volatility(self) -> np.ndarray:
+        """Volatilidad anualizada de las rentabilidades logarítmicas diarias de la ventana."""
+        w = self.vol_window
+        k = min(self._ret_obs, w)
+        if k < 2: return np.full(len(self.tickers), np.nan)
+        var = (self._r_sq - self._r_sum ** 2 / k) / (k - 1)
+        vol = np.sqrt(np.clip(var, 0, None) * TRADING_DAYS)
+        return np.where(self.n > w, vol, np.nan)
+
+    def drawdown(self) -> np.ndarray:
+        return self.last / self.peak - 1
+
+    def snapshot(self) -> dict:
+        """{ticker: métricas} listo para JSON (None donde no hay histórico suficiente)."""
+        cols = {"rsi": self.rsi(), "volatility": self.volatility(), "drawdown": self.drawdown(), "max_drawdown": self.max_drawdown, "last": self.last}
+        for w in self.sma_windows: cols[f"sma{w}"] = self.sma(w)
+        out = {}
+        for j, t in enumerate(self.tickers):
+            out[t] = {k: (round(float(v[j]), 4) if np.isfinite(v[j]) else None) for k, v in cols.items()}
+        return out
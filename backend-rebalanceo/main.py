@@ -1,23 +1,119 @@
 import os
+import re
 import urllib.parse
 import math
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+import hashlib
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+import httpx
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from supabase import create_client, Client
-import yfinance as yf
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import BaseModel, Field
+from supabase import AsyncClient, AsyncClientOptions
 import pandas as pd
 import numpy as np
 import feedparser
 from typing import List, Optional, Dict, Any
 from dotenv import load_dotenv
+from cache import TTLCache
+from simulation import run_projection, run_historical_projection, estimate_return_stats, run_grid, GRID_ARRAYS
+from indicators import Indicators
+from history_store import HistoryStore, MAX_RANGE, frame_to_bars
+from search_index import SearchIndex
+from streaming import PortfolioStream
+from rebalance_solver import solve_rebalance, tracking_error
+from fx import conversion_factor, fx_ticker, fx_tickers, split_currency
+from metrics import MetricsMiddleware, registry as metrics_registry, track, bind, instrument_supabase
+from market_data import create_provider, NoData
+from value_series import ValueSeriesStore, value_points, lttb
+from prewarm import Prewarmer
 
 # --- CONFIGURACIÓN ---
 load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+QUOTE_CACHE_TTL = float(os.getenv("QUOTE_CACHE_TTL", "60"))
+QUOTE_CACHE_SIZE = int(os.getenv("QUOTE_CACHE_SIZE", "2048"))
+# Divisa de valoración por defecto de las carteras (columna portfolios.base_currency, ver sql/currency.sql)
+BASE_CURRENCY = os.getenv("BASE_CURRENCY", "EUR").upper()
+CURRENCY_CACHE_TTL = float(os.getenv("CURRENCY_CACHE_TTL", "300"))
+# Concurrencia: hilos para llamadas bloqueantes (yfinance/feedparser) y límites por upstream
+IO_THREADS = int(os.getenv("IO_THREADS", "32"))
+MARKET_DATA_CONCURRENCY = int(os.getenv("MARKET_DATA_CONCURRENCY", "8"))
+# Proveedor de datos de mercado: yfinance o ficheros locales (fixtures), con timeout por llamada y circuit breaker
+MARKET_DATA_BACKEND = os.getenv("MARKET_DATA_BACKEND", "yfinance")
+MARKET_DATA_FIXTURES = os.getenv("MARKET_DATA_FIXTURES", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "fixtures"))
+MARKET_DATA_TIMEOUT = float(os.getenv("MARKET_DATA_TIMEOUT", "15"))
+MARKET_BREAKER_THRESHOLD = int(os.getenv("MARKET_BREAKER_THRESHOLD", "5"))
+MARKET_BREAKER_COOLDOWN = float(os.getenv("MARKET_BREAKER_COOLDOWN", "30"))
+SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "50"))  # con ?before= sin limit; sin ninguno de los dos se devuelve todo el historial
+OVERVIEW_HISTORY_LIMIT = int(os.getenv("OVERVIEW_HISTORY_LIMIT", "5"))
+MAX_SIM_PATHS = int(os.getenv("MAX_SIM_PATHS", "50000"))
+MAX_SIM_YEARS = int(os.getenv("MAX_SIM_YEARS", "100"))
+MAX_SIM_CELLS = int(os.getenv("MAX_SIM_CELLS", "24000000"))  # meses x caminos por simulación (matriz float32 de ~100 MB)
+MAX_GRID_CELLS = int(os.getenv("MAX_GRID_CELLS", "20000000"))  # float64 vivos a la vez en /simulations/batch (~160 MB; ver GRID_ARRAYS)
+HIST_SIM_PERIOD = os.getenv("HIST_SIM_PERIOD", "10y")
+# Noticias: feeds en paralelo con límite y timeout por feed; RSI con tope de espera
+NEWS_CONCURRENCY = int(os.getenv("NEWS_CONCURRENCY", "8"))
+NEWS_FEED_TIMEOUT = float(os.getenv("NEWS_FEED_TIMEOUT", "4"))
+NEWS_CACHE_TTL = float(os.getenv("NEWS_CACHE_TTL", "600"))
+NEWS_RSI_TIMEOUT = float(os.getenv("NEWS_RSI_TIMEOUT", "8"))
+INDICATOR_PERIOD = os.getenv("INDICATOR_PERIOD", "1y")
+HISTORY_DIR = os.getenv("HISTORY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "history"))
+VALUE_SERIES_DIR = os.getenv("VALUE_SERIES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "value_series"))
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "search_index.json"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "86400"))
+SEARCH_INDEX_MAX = int(os.getenv("SEARCH_INDEX_MAX", "20000"))  # resultados de Yahoo guardados (los de assets no cuentan)
+SEARCH_INDEX_SAVE_INTERVAL = float(os.getenv("SEARCH_INDEX_SAVE_INTERVAL", "300"))
+POSTGREST_MAX_ROWS = 1000  # max-rows por defecto de PostgREST en Supabase: tamaño de página al leer tablas enteras
+SEARCH_LIMIT = 8
+# Streaming de valoraciones: cada cuánto refresca el poller compartido y keep-alive de SSE
+STREAM_INTERVAL = float(os.getenv("STREAM_INTERVAL", str(QUOTE_CACHE_TTL)))
+STREAM_KEEPALIVE = float(os.getenv("STREAM_KEEPALIVE", "15"))
+# Peticiones más lentas que esto se registran con el desglose por upstream
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+# Pre-calentamiento en segundo plano de las carteras usadas en la última PREWARM_ACTIVE_WINDOW (segundos)
+PREWARM_ENABLED = os.getenv("PREWARM_ENABLED", "1") == "1"
+PREWARM_ACTIVE_WINDOW = float(os.getenv("PREWARM_ACTIVE_WINDOW", "1800"))
+PREWARM_MAX_PORTFOLIOS = int(os.getenv("PREWARM_MAX_PORTFOLIOS", "200"))
+PREWARM_BATCH = int(os.getenv("PREWARM_BATCH", "50"))  # tickers por llamada al upstream
+PREWARM_PAUSE = float(os.getenv("PREWARM_PAUSE", "2"))  # segundos entre lotes
+PREWARM_JITTER = float(os.getenv("PREWARM_JITTER", "0.2"))
+PREWARM_BARS_INTERVAL = float(os.getenv("PREWARM_BARS_INTERVAL", "900"))
 
-app = FastAPI(title="Fandance API")
+io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="io")
+market_semaphore = asyncio.Semaphore(MARKET_DATA_CONCURRENCY)
+news_semaphore = asyncio.Semaphore(NEWS_CONCURRENCY)
+feeds_http = httpx.AsyncClient(timeout=NEWS_FEED_TIMEOUT, follow_redirects=True)
+supabase_http = httpx.AsyncClient(
+    timeout=SUPABASE_TIMEOUT,
+    limits=httpx.Limits(max_connections=SUPABASE_MAX_CONNECTIONS, max_keepalive_connections=SUPABASE_MAX_CONNECTIONS),
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await load_search_index()
+    saver = asyncio.create_task(save_search_index_loop())
+    if PREWARM_ENABLED: prewarmer.start()
+    yield
+    await prewarmer.close()
+    saver.cancel()
+    await asyncio.gather(saver, return_exceptions=True)
+    await save_search_index()
+    await portfolio_stream.close()
+    market.close()
+    await supabase_http.aclose()
+    await feeds_http.aclose()
+    io_executor.shutdown(wait=False)
+
+app = FastAPI(title="Fandance API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -25,15 +121,43 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
 )
+# Llamadas a upstreams por petición (Server-Timing), métricas en /metrics y log de peticiones lentas
+app.add_middleware(MetricsMiddleware, slow_ms=SLOW_REQUEST_MS)
 
 try:
     if not SUPABASE_URL or not SUPABASE_KEY:
         raise Exception("Faltan credenciales en .env")
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase: AsyncClient = instrument_supabase(AsyncClient(SUPABASE_URL, SUPABASE_KEY, AsyncClientOptions(httpx_client=supabase_http, postgrest_client_timeout=SUPABASE_TIMEOUT)))
 except Exception as e:
     print(f"❌ Error Supabase: {e}")
 
+market = create_provider(MARKET_DATA_BACKEND, MARKET_DATA_FIXTURES, timeout=MARKET_DATA_TIMEOUT,
+                         threshold=MARKET_BREAKER_THRESHOLD, cooldown=MARKET_BREAKER_COOLDOWN, workers=MARKET_DATA_CONCURRENCY * 2)
+
+# Caché de cotizaciones compartida por todas las peticiones (clave: ticker)
+quote_cache = TTLCache(maxsize=QUOTE_CACHE_SIZE, ttl=QUOTE_CACHE_TTL, name="quotes")
+# Estadísticas de rentabilidad histórica por conjunto de tickers y día
+return_stats_cache = TTLCache(maxsize=256, ttl=86400, name="return_stats")
+# Feeds de noticias por URL (~10 min); indicadores por (ticker, día) y estado vectorizado por (tickers, día)
+news_cache = TTLCache(maxsize=1024, ttl=NEWS_CACHE_TTL, name="news_feeds")
+indicator_cache = TTLCache(maxsize=4096, ttl=86400, name="indicators")
+indicator_state_cache = TTLCache(maxsize=256, ttl=86400, name="indicator_states")
+# Barras OHLC en disco para los gráficos: solo se descarga la cola que falta
+history_store = HistoryStore(HISTORY_DIR)
+# Valor diario precalculado de cada cartera para los gráficos de rango largo (se amplía al ritmo de las barras diarias)
+value_store = ValueSeriesStore(VALUE_SERIES_DIR, refresh=history_store.refresh["1d"])
+# Índice local de búsqueda (tabla assets + resultados previos de Yahoo) y memo de consultas a Yahoo
+search_index = SearchIndex(SEARCH_INDEX_PATH, max_entries=SEARCH_INDEX_MAX)
+search_cache = TTLCache(maxsize=4096, ttl=SEARCH_CACHE_TTL, name="search")
+# Carteras activas y trabajos de refresco anticipado (ver el final del fichero)
+prewarmer = Prewarmer(active_for=PREWARM_ACTIVE_WINDOW, max_portfolios=PREWARM_MAX_PORTFOLIOS, pause=PREWARM_PAUSE, jitter=PREWARM_JITTER)
+# Divisa base por cartera; TTL corto porque con varios workers update_currency solo actualiza el suyo
+base_currencies = TTLCache(maxsize=QUOTE_CACHE_SIZE, ttl=CURRENCY_CACHE_TTL, name="base_currencies")
+
+CACHES = (quote_cache, return_stats_cache, news_cache, indicator_cache, indicator_state_cache, search_cache, base_currencies)
+
 # --- UTILIDADES ---
 def safe_float(val):
     if val is None: return 0.0
@@ -43,10 +167,76 @@ def safe_float(val):
         return f
     except: return 0.0
 
+async def run_io(fn, *args):
+    # Ejecuta una llamada bloqueante de datos de mercado en el pool de IO, limitada por el semáforo
+    async with market_semaphore:
+        return await asyncio.get_running_loop().run_in_executor(io_executor, bind(fn), *args)
+
+async def run_cpu(fn, *args):
+    # Cálculo numérico fuera del event loop (sin consumir cupo de datos de mercado)
+    return await asyncio.get_running_loop().run_in_executor(io_executor, bind(fn), *args)
+
+class RPCUnavailable(Exception):
+    pass
+
+missing_rpcs = set()
+
+async def call_rpc(fn: str, params: dict):
+    # Función SQL transaccional (ver sql/); RPCUnavailable si no está desplegada en la base de datos
+    if fn in missing_rpcs: raise RPCUnavailable(fn)
+    try:
+        return (await supabase.rpc(fn, params).execute()).data
+    except Exception as e:
+        if getattr(e, "code", None) != "PGRST202": raise
+        print(f"RPC {fn} no desplegada, usando ruta alternativa")
+        missing_rpcs.add(fn)
+        raise RPCUnavailable(fn)
+
+# Índice ticker -> asset_id en memoria: los activos no cambian de id una vez creados en add_asset
+asset_ids: Dict[str, str] = {}
+
+def remember_asset(ticker: str, asset_id):
+    if ticker and asset_id: asset_ids[ticker] = asset_id
+
+async def resolve_asset_ids(tickers: List[str]) -> Dict[str, str]:
+    # Los que no están en el índice se resuelven en una sola consulta
+    missing = [t for t in dict.fromkeys(tickers) if t and t not in asset_ids]
+    if missing:
+        res = await supabase.table("assets").select("id, ticker").in_("ticker", missing).execute()
+        for a in res.data: remember_asset(a['ticker'], a['id'])
+    return {t: asset_ids[t] for t in tickers if t in asset_ids}
+
+def remember_currency(portfolio_id: str, currency) -> str:
+    code = split_currency(currency, BASE_CURRENCY)[0]
+    if portfolio_id: base_currencies.set(portfolio_id, code)
+    return code
+
+async def portfolio_currencies(portfolio_ids: List[str]) -> Dict[str, str]:
+    found = {p: base_currencies.get(p) for p in dict.fromkeys(portfolio_ids)}
+    missing = [p for p, c in found.items() if c is None]
+    if missing:
+        try:
+            res = await supabase.table("portfolios").select("id, base_currency").in_("id", missing).execute()
+            for p in res.data: found[p['id']] = remember_currency(p['id'], p.get('base_currency'))
+        except Exception as e:
+            # Solo si la columna no existe (sql/currency.sql sin aplicar) todas usan BASE_CURRENCY de forma estable;
+            # ante cualquier otro error se usa para esta petición pero no se guarda
+            if getattr(e, "code", None) == "42703":
+                for p in missing: found[p] = remember_currency(p, None)
+            else: print(f"Base currency error: {e}")
+    return {p: found.get(p) or BASE_CURRENCY for p in portfolio_ids}
+
+def quote_tickers(rows: List[dict], bases) -> List[str]:
+    # Tickers de los activos + tipos de cambio que hacen falta, para pedirlos juntos en una sola descarga
+    tickers = [i['asset']['ticker'] for i in rows if i.get('asset')]
+    pairs = [(i['asset'].get('currency'), b) for i in rows if i.get('asset') for b in bases]
+    return tickers + fx_tickers(pairs)
+
 # --- MODELOS ---
 class CreatePortfolioInput(BaseModel):
     user_id: str
     name: str
+    base_currency: Optional[str] = None
 
 class RenamePortfolioInput(BaseModel):
     portfolio_id: str
@@ -70,6 +260,13 @@ class UpdateItemInput(BaseModel):
 class RebalanceInput(BaseModel):
     portfolio_id: str
     contribution: float
+    # mode="solver": unidades enteras, sin ventas, orden mínima y comisiones (ver rebalance_solver)
+    mode: str = "naive"
+    whole_units: bool = True
+    allow_sell: bool = False
+    min_order: float = 0.0
+    fee_fixed: float = 0.0
+    fee_rate: float = 0.0
 
 class ApplyRebalanceInput(BaseModel):
     portfolio_id: str
@@ -79,28 +276,50 @@ class ApplyRebalanceInput(BaseModel):
 class HistoryInput(BaseModel):
     portfolio_id: str
     period: str = "1mo" 
+    points: Optional[int] = None  # Reducir la serie a N puntos (LTTB); None = todos
 
 class SimulationInput(BaseModel):
     portfolio_ids: List[str]
-    years: int
+    years: int = Field(ge=0, le=MAX_SIM_YEARS)
     initial_capital: float
     monthly_contribution: float
     contribution_mode: str 
     growth_rate: float = 0.0 
     tax_rate: bool 
     sim_type: str 
+    paths: int = 10000  # Caminos Monte Carlo
+    seed: Optional[int] = None  # Para resultados reproducibles
+    target_value: Optional[float] = None  # Objetivo para la probabilidad de alcanzarlo
+
+class SimulationGridInput(BaseModel):
+    # Cada lista es un eje de la rejilla; se evalúa el producto cartesiano completo
+    portfolio_ids: List[str]
+    initial_capital: float = 0.0  # Capital inicial de las carteras vacías
+    annual_returns: List[float] = [0.04, 0.07]
+    volatilities: List[float] = [0.0]  # > 0 -> Monte Carlo
+    contribution_modes: List[str] = ["constant"]
+    monthly_contributions: List[float] = [0.0]
+    years: List[int] = [10]
+    tax_rate: List[bool] = [False]
+    growth_rate: float = 0.0
+    paths: int = 2000
+    seed: Optional[int] = None
+    target_value: Optional[float] = None
 
 class NewsInput(BaseModel):
     assets: List[dict] 
 
 # --- DATA FETCHING ---
-def get_asset_metadata(ticker: str):
+def normalize_ticker(ticker: str) -> str:
     clean_ticker = ticker.strip().upper()
     if clean_ticker == "BTC": clean_ticker = "BTC-EUR"
+    return clean_ticker
+
+def get_asset_metadata(ticker: str):
+    clean_ticker = normalize_ticker(ticker)
     try:
-        t = yf.Ticker(clean_ticker)
         try:
-            info = t.info
+            info = market.info(clean_ticker)
             name = info.get('longName') or info.get('shortName') or ticker
             qtype = info.get('quoteType', 'EQUITY')
             sector = info.get('sector') or 'General'
@@ -118,30 +337,151 @@ def get_asset_metadata(ticker: str):
     except:
         return { "name": ticker, "type": "Stock", "sector": "Unknown", "country": "Unknown", "currency": "USD", "real_ticker": clean_ticker }
 
-def fetch_live_price(ticker: str):
-    if not ticker: return 0.0
+def _download_quotes(tickers: List[str]) -> Dict[str, float]:
+    # Una sola llamada por lote para todos los fallos de caché (el proveedor reintenta por ticker lo que falte)
+    try: return market.quotes(tickers)
+    except Exception as e:
+        print(f"Quote batch error: {e}")
+        return {}
+
+def last_known_price(ticker: str) -> float:
+    # Último cierre diario guardado en disco (tras un reinicio aún no hay cotizaciones en memoria)
+    bars = history_store.load(ticker, "1d")
+    return safe_float(bars["close"][-1]) if bars is not None and len(bars) else 0.0
+
+def fetch_live_prices(tickers: List[str]) -> Dict[str, float]:
+    tickers = [t for t in dict.fromkeys(tickers) if t]
+    if not tickers: return {}
+    prices = quote_cache.get_many(tickers, _download_quotes)
+    # Si el upstream falla se sirve el último precio conocido (sin cachearlo) en lugar de valorar a cero
+    missing = [t for t in tickers if t not in prices]
+    if missing:
+        prices.update(market.last_quotes(missing))
+        for t in missing:
+            if t not in prices: prices[t] = last_known_price(t)
+    return {t: prices.get(t, 0.0) for t in tickers}
+
+def _download_return_stats(tickers: tuple):
     try:
-        t = yf.Ticker(ticker)
-        price = t.fast_info.last_price
-        if price is None:
-            hist = t.history(period="1d")
-            if not hist.empty: price = hist["Close"].iloc[-1]
-        return safe_float(price)
-    except: return 0.0
+        return estimate_return_stats(market.closes(tickers, HIST_SIM_PERIOD, "1mo"))
+    except Exception as e:
+        print(f"Return stats error: {e}")
+        return None
+
+def get_return_stats(tickers: List[str]):
+    # Una descarga y una estimación por conjunto de tickers y día; los fallos no se cachean
+    key = (tuple(sorted(set(t for t in tickers if t))), date.today().isoformat())
+    if not key[0]: return None
+    def load(keys):
+        stats = _download_return_stats(key[0])
+        return {key: stats} if stats else {}
+    return return_stats_cache.get_many([key], load).get(key)
+
+def portfolio_weights(port: List[dict], tickers: List[str]):
+    # Pesos objetivo alineados con `tickers`; si no hay objetivos se usan los pesos reales
+    target, value = {}, {}
+    for x in port:
+        t = x['asset']['ticker']
+        target[t] = target.get(t, 0.0) + safe_float(x.get('target_weight'))
+        value[t] = value.get(t, 0.0) + safe_float(x.get('value'))
+    for source in (target, value):
+        w = np.array([source.get(t, 0.0) for t in tickers])
+        if w.sum() > 0: return w / w.sum()
+    return None
+
+def _download_indicators(keys: List[tuple]) -> Dict[tuple, dict]:
+    # Una sola descarga y una pasada vectorizada para todos los tickers sin indicadores en caché
+    try:
+        snap = Indicators.from_frame(market.closes([k[0] for k in keys], INDICATOR_PERIOD)).snapshot()
+    except Exception as e:
+        print(f"Indicators batch error: {e}")
+        return {}
+    return {k: snap[k[0]] for k in keys if k[0] in snap}
+
+def get_indicators(tickers: List[str]) -> Dict[str, dict]:
+    # Métricas al cierre diario por ticker (RSI, medias, volatilidad, drawdown), cacheadas por día
+    day = date.today().isoformat()
+    res = indicator_cache.get_many([(t, day) for t in tickers], _download_indicators)
+    return {t: res[(t, day)] for t in tickers if (t, day) in res}
+
+def get_indicator_state(tickers: List[str]):
+    # Estado incremental para un conjunto de tickers; permite aplicar la cotización del día sin recalcular.
+    # Se construye hasta el cierre anterior: la barra de hoy (parcial en sesión) la aporta luego preview()
+    key = (tuple(sorted(set(tickers))), date.today().isoformat())
+    def load(keys):
+        try:
+            closes = market.closes(key[0], INDICATOR_PERIOD)
+            return {key: Indicators.from_frame(closes[closes.index < pd.Timestamp(key[1])])}
+        except Exception as e:
+            print(f"Indicators state error: {e}")
+            return {}
+    return indicator_state_cache.get_many([key], load).get(key)
+
+def clean_asset_name(name, ticker):
+    # 1. Remove common ETF/fund terms
+    cleaned = re.sub(r'(?i)(UCITS|ETF|Acc|Dist|EUR|USD|Class|\(.*\)|Corp|Bond|Index|Fund|iShares|Vanguard|Amundi|Xtrackers|SPDR|Invesco)', '', name)
+    # 2. Remove extra spaces
+    cleaned = " ".join(cleaned.split())
+    # 3. If result is too short, use ticker, else use cleaned name
+    return cleaned if len(cleaned) > 3 else ticker
 
-def calculate_rsi(ticker: str):
+def news_feed_url(name, ticker):
+    # Search for the asset name + "finance" or "stock"
+    query_term = clean_asset_name(name, ticker)
+    return f"https://news.google.com/rss/search?q={urllib.parse.quote(query_term + ' finance news')}&hl=en-US&gl=US&ceid=US:en"
+
+async def _load_news_feed(url: str):
+    async with news_semaphore:
+        with track("rss"): resp = await asyncio.wait_for(feeds_http.get(url), NEWS_FEED_TIMEOUT)
+    resp.raise_for_status()
+    feed = await run_cpu(feedparser.parse, resp.content)
+    items = []
+    for e in feed.entries[:4]: # Limit to 4 items per asset
+        items.append({
+            "title": e.title, 
+            "link": e.link, 
+            "publisher": e.source.title if hasattr(e,'source') else "News", 
+            "time": e.published if hasattr(e,'published') else "Reciente"
+        })
+    return items
+
+async def fetch_news_feed(url: str):
+    # None si el feed falla o tarda demasiado (no se cachea)
+    return await news_cache.aget_or_load(url, _load_news_feed)
+
+def _fetch_bars(tickers: List[str], interval: str, start) -> Optional[Dict[str, np.ndarray]]:
+    # Descarga OHLCV de un lote de tickers para el HistoryStore (start=None -> rango máximo del intervalo)
+    # {} = el upstream respondió sin datos; None = error (no se marca nada como al día y se reintenta)
     try:
-        df = yf.download(ticker, period="1mo", interval="1d", progress=False)
-        if df.empty or len(df) < 14: return 50
-        if isinstance(df, pd.DataFrame) and 'Close' in df.columns: close = df['Close']
-        else: close = df.iloc[:, 0]
-        delta = close.diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        return round(safe_float(rsi.iloc[-1]))
-    except: return 50
+        if start is None: df = market.history(tickers, interval, period=MAX_RANGE[interval])
+        else: df = market.history(tickers, interval, start=pd.Timestamp(start, unit="s"))
+    except NoData: return {}
+    except Exception as e:
+        print(f"Bars download error: {e}")
+        return None
+    if df is None or df.empty: return {}
+    out = {}
+    for t in tickers:
+        try:
+            sub = df.xs(t, axis=1, level=1) if isinstance(df.columns, pd.MultiIndex) else df
+            out[t] = frame_to_bars(sub, interval)
+        except KeyError: continue
+    return out
+
+def load_chart_closes(tickers: List[str], interval: str, period: str) -> pd.DataFrame:
+    history_store.sync(tickers, interval, _fetch_bars)
+    df = history_store.closes(tickers, interval)
+    return df.loc[df.index >= _period_start(period, df.index)] if not df.empty else df
+
+def _period_start(period: str, index: pd.DatetimeIndex):
+    # Mismo significado que `period` en yf.download: Nd = últimas N sesiones; mo/y/ytd = calendario
+    if period == "max" or index.empty: return index.min()
+    if period == "ytd": return pd.Timestamp(index.max().year, 1, 1)
+    n = int(re.match(r"\d+", period).group())
+    if period.endswith("mo"): return index.max() - pd.DateOffset(months=n)
+    if period.endswith("y"): return index.max() - pd.DateOffset(years=n)
+    sessions = index.normalize().unique()
+    return sessions[-min(n, len(sessions))]
 
 def get_sentiment_label(score):
     if score >= 70: return "Sobrecompra (RSI)", "very_green"
@@ -152,119 +492,329 @@ def get_sentiment_label(score):
 
 # --- ENDPOINTS ---
 @app.post("/portfolios/create")
-def create_portfolio(data: CreatePortfolioInput):
+async def create_portfolio(data: CreatePortfolioInput):
     try:
-        res = supabase.table("portfolios").insert({"user_id": data.user_id, "name": data.name}).execute()
+        row = {"user_id": data.user_id, "name": data.name}
+        if data.base_currency: row["base_currency"] = data.base_currency.upper()
+        res = await supabase.table("portfolios").insert(row).execute()
         return res.data[0]
     except Exception as e: raise HTTPException(500, str(e))
 
 @app.get("/portfolios/list")
-def list_portfolios(user_id: str):
-    res = supabase.table("portfolios").select("*").eq("user_id", user_id).order('created_at').execute()
+async def list_portfolios(user_id: str):
+    res = await supabase.table("portfolios").select("*").eq("user_id", user_id).order('created_at').execute()
+    for p in res.data:
+        if 'base_currency' in p: remember_currency(p['id'], p['base_currency'])
     return res.data
 
 @app.put("/portfolios/rename")
-def rename_portfolio(data: RenamePortfolioInput):
-    supabase.table("portfolios").update({"name": data.name}).eq("id", data.portfolio_id).execute()
+async def rename_portfolio(data: RenamePortfolioInput):
+    await supabase.table("portfolios").update({"name": data.name}).eq("id", data.portfolio_id).execute()
     return {"msg": "OK"}
 
 @app.post("/portfolios/duplicate")
-def duplicate_portfolio(data: DuplicatePortfolioInput):
+async def duplicate_portfolio(data: DuplicatePortfolioInput):
     try:
-        res = supabase.table("portfolios").insert({"user_id": data.user_id, "name": data.new_name}).execute()
+        res, items = await asyncio.gather(
+            supabase.table("portfolios").insert({"user_id": data.user_id, "name": data.new_name}).execute(),
+            supabase.table("portfolio_items").select("*").eq("portfolio_id", data.portfolio_id).execute(),
+        )
         new_id = res.data[0]["id"]
-        items = supabase.table("portfolio_items").select("*").eq("portfolio_id", data.portfolio_id).execute()
         if items.data:
             new_items = [{"portfolio_id": new_id, "asset_id": i["asset_id"], "units_held": i["units_held"], "target_weight": i["target_weight"]} for i in items.data]
-            supabase.table("portfolio_items").insert(new_items).execute()
+            await supabase.table("portfolio_items").insert(new_items).execute()
         return {"msg": "Duplicated"}
     except Exception as e: raise HTTPException(500, str(e))
 
 @app.delete("/portfolios/delete/{portfolio_id}")
-def delete_portfolio(portfolio_id: str):
-    supabase.table("portfolios").delete().eq("id", portfolio_id).execute()
+async def delete_portfolio(portfolio_id: str):
+    await supabase.table("portfolios").delete().eq("id", portfolio_id).execute()
+    value_store.invalidate(portfolio_id)
     return {"msg": "OK"}
 
 @app.put("/portfolios/update_contribution")
-def update_contribution(portfolio_id: str, amount: float):
-    supabase.table("portfolios").update({"last_contribution": amount}).eq("id", portfolio_id).execute()
+async def update_contribution(portfolio_id: str, amount: float):
+    await supabase.table("portfolios").update({"last_contribution": amount}).eq("id", portfolio_id).execute()
     return {"msg": "Updated"}
 
-@app.get("/assets/search")
-def search_assets(q: str):
-    if not q or len(q) < 2: return []
-    results = []
+@app.put("/portfolios/update_currency")
+async def update_currency(portfolio_id: str, currency: str):
+    currency = currency.upper()
+    await supabase.table("portfolios").update({"base_currency": currency}).eq("id", portfolio_id).execute()
+    remember_currency(portfolio_id, currency)
+    value_store.invalidate(portfolio_id)
+    return {"msg": "Updated"}
+
+@app.get("/cache/stats")
+def cache_stats():
+    stats = {c.name: c.stats() for c in CACHES}
+    stats["search_index"] = {"size": len(search_index)}
+    stats["stream"] = portfolio_stream.stats()
+    stats["value_series"] = {"builds": value_store.builds}
+    stats["prewarm"] = prewarmer.stats()
+    stats["market"] = market.stats()
+    return stats
+
+@app.get("/metrics")
+def metrics():
+    # Formato de texto de Prometheus: peticiones, upstreams y cachés
+    extra = ["# TYPE fandance_cache_hits_total counter"]
+    extra += [f'fandance_cache_hits_total{{cache="{c.name}"}} {c.hits}' for c in CACHES]
+    extra.append("# TYPE fandance_cache_misses_total counter")
+    extra += [f'fandance_cache_misses_total{{cache="{c.name}"}} {c.misses}' for c in CACHES]
+    extra.append("# TYPE fandance_cache_entries gauge")
+    extra += [f'fandance_cache_entries{{cache="{c.name}"}} {len(c)}' for c in CACHES]
+    m = market.stats()
+    extra.append("# TYPE fandance_market_circuit_open gauge")
+    extra.append(f'fandance_market_circuit_open{{backend="{m["backend"]}"}} {int(m["state"] != "closed")}')
+    for key in ("failures", "timeouts", "rejected", "stale_quotes", "coalesced"):
+        extra.append(f"# TYPE fandance_market_{key}_total counter")
+        extra.append(f'fandance_market_{key}_total{{backend="{m["backend"]}"}} {m[key]}')
+    return PlainTextResponse(metrics_registry.render(extra), media_type="text/plain; version=0.0.4")
+
+TYPE_DISPLAY = {"Stock": "Acción", "ETF": "ETF", "Crypto": "Cripto", "Fund": "Fondo"}
+
+async def load_search_index():
+    # Al arrancar: lo guardado en disco + todos los activos ya dados de alta (por páginas: PostgREST corta en max-rows)
+    await run_io(search_index.load)
     try:
-        y_res = yf.Search(q, max_results=8).quotes
-        for quote in y_res:
-            sym = quote.get('symbol')
-            if not sym: continue
-            qtype = quote.get('quoteType', 'EQUITY')
-            dtype = "Acción"
-            if 'ETF' in str(qtype): dtype = "ETF"
-            elif 'CRYPTO' in str(qtype): dtype = "Cripto"
-            elif 'FUND' in str(qtype): dtype = "Fondo"
-            results.append({ "ticker": sym, "name": quote.get('shortname') or quote.get('longname') or sym, "type_display": dtype, "exchange": quote.get('exchange', '') })
-    except: pass
+        start = 0
+        while True:
+            res = await supabase.table("assets").select("id, ticker, name, type").order("id").range(start, start + POSTGREST_MAX_ROWS - 1).execute()
+            for a in res.data:
+                remember_asset(a['ticker'], a['id'])
+                search_index.add({"ticker": a['ticker'], "name": a.get('name') or a['ticker'], "type_display": TYPE_DISPLAY.get(a.get('type'), "Acción"), "exchange": ""}, overwrite=False, pinned=True)
+            if len(res.data) < POSTGREST_MAX_ROWS: break
+            start += POSTGREST_MAX_ROWS
+    except Exception as e:
+        print(f"Search index error: {e}")
+
+async def save_search_index():
+    if not search_index.dirty: return
+    try: await run_io(search_index.save)
+    except Exception as e:
+        print(f"Search index save error: {e}")
+
+async def save_search_index_loop():
+    # Los resultados nuevos de Yahoo solo marcan el índice; se escribe a disco cada SEARCH_INDEX_SAVE_INTERVAL y al cerrar
+    while True:
+        await asyncio.sleep(SEARCH_INDEX_SAVE_INTERVAL)
+        await save_search_index()
+
+def _yahoo_search(q: str) -> list:
+    results = []
+    y_res = market.search(q, SEARCH_LIMIT)
+    for quote in y_res:
+        sym = quote.get('symbol')
+        if not sym: continue
+        qtype = quote.get('quoteType', 'EQUITY')
+        dtype = "Acción"
+        if 'ETF' in str(qtype): dtype = "ETF"
+        elif 'CRYPTO' in str(qtype): dtype = "Cripto"
+        elif 'FUND' in str(qtype): dtype = "Fondo"
+        results.append({ "ticker": sym, "name": quote.get('shortname') or quote.get('longname') or sym, "type_display": dtype, "exchange": quote.get('exchange', '') })
+    for r in results: search_index.add(r)
     return results
 
+async def _load_yahoo_search(q: str):
+    try: return await run_io(_yahoo_search, q)
+    except Exception as e:
+        print(f"Search error: {e}")
+        return None
+
+@app.get("/assets/search")
+async def search_assets(q: str):
+    if not q or len(q) < 2: return []
+    # 1) prefijo en el índice local; 2) Yahoo (memoizado por consulta) solo si no llena la página; 3) aproximadas
+    results = search_index.search(q, SEARCH_LIMIT, fuzzy=False)
+    if len(results) < SEARCH_LIMIT:
+        results += await search_cache.aget_or_load(_norm_query(q), _load_yahoo_search, default=[])
+        results += search_index.search(q, SEARCH_LIMIT)
+    seen = set()
+    return [r for r in results if not (r["ticker"] in seen or seen.add(r["ticker"]))][:SEARCH_LIMIT]
+
+def _norm_query(q: str) -> str:
+    return " ".join(q.lower().split())
+
 @app.post("/portfolio/add")
-def add_asset(data: AddAssetInput):
+async def add_asset(data: AddAssetInput):
     try:
-        meta = get_asset_metadata(data.ticker)
-        final_ticker = meta['real_ticker']
+        final_ticker = normalize_ticker(data.ticker)
         asset_id = None
-        existing = supabase.table("assets").select("id").eq("ticker", final_ticker).execute()
+        # Si el activo ya existe no hace falta pedir sus metadatos (t.info es lento)
+        existing = await supabase.table("assets").select("id, name").eq("ticker", final_ticker).execute()
         if existing.data:
             asset_id = existing.data[0]["id"]
+            meta = {"name": existing.data[0].get("name") or final_ticker}
         else:
+            meta = await run_io(get_asset_metadata, data.ticker)
+            search_index.add({"ticker": final_ticker, "name": meta["name"], "type_display": TYPE_DISPLAY.get(meta["type"], "Acción"), "exchange": ""}, overwrite=False, pinned=True)
             try:
-                new_asset = supabase.table("assets").insert({
+                new_asset = await supabase.table("assets").insert({
                     "ticker": final_ticker, "name": meta["name"], "type": meta["type"], "sector": meta["sector"], "country": meta["country"], "currency": meta["currency"]
                 }).execute()
                 if new_asset.data: asset_id = new_asset.data[0]["id"]
             except:
-                r = supabase.table("assets").select("id").eq("ticker", final_ticker).execute()
+                r = await supabase.table("assets").select("id").eq("ticker", final_ticker).execute()
                 if r.data: asset_id = r.data[0]["id"]
         if not asset_id: raise HTTPException(500, "Error crítico: ID")
-        exists_item = supabase.table("portfolio_items").select("id").eq("portfolio_id", data.portfolio_id).eq("asset_id", asset_id).execute()
+        remember_asset(final_ticker, asset_id)
+        exists_item = await supabase.table("portfolio_items").select("id").eq("portfolio_id", data.portfolio_id).eq("asset_id", asset_id).execute()
         if not exists_item.data:
-            supabase.table("portfolio_items").insert({"portfolio_id": data.portfolio_id, "asset_id": asset_id, "units_held": 0, "target_weight": 0}).execute()
+            await supabase.table("portfolio_items").insert({"portfolio_id": data.portfolio_id, "asset_id": asset_id, "units_held": 0, "target_weight": 0}).execute()
         return {"status": "ok", "asset_name": meta["name"]}
     except Exception as e: raise HTTPException(500, str(e))
 
+def value_items(rows: List[dict], prices: Dict[str, float], base: str = BASE_CURRENCY) -> List[dict]:
+    # Valor y peso real de cada posición (filas de portfolio_items con el activo embebido), en la divisa base.
+    # current_price va convertido a la divisa base (lo usan rebalanceo y simulación); quote_price es la cotización original
+    data = []
+    for i in rows:
+        if not i.get('asset'): continue
+        remember_asset(i['asset']['ticker'], i['asset'].get('id'))
+        quote = prices.get(i['asset']['ticker'], 0.0)
+        price = safe_float(quote * conversion_factor(i['asset'].get('currency'), base, prices))
+        val = safe_float(float(i['units_held']) * price)
+        data.append({**i, "current_price": price, "quote_price": quote, "base_currency": base, "value": round(val, 2)})
+    total = sum(x["value"] for x in data)
+    for x in data: x["real_weight"] = round(x["value"]/total*100, 2) if total > 0 else 0
+    return data
+
+def etag_response(request: Request, payload) -> Response:
+    # JSON con ETag; si el cliente ya tiene esa versión (If-None-Match) se responde 304 sin cuerpo
+    body = json.dumps(jsonable_encoder(payload), separators=(",", ":"), ensure_ascii=False).encode()
+    etag = f'W/"{hashlib.sha1(body).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.get("/portfolios/overview")
+async def portfolios_overview(user_id: str, request: Request, history_limit: int = Query(OVERVIEW_HISTORY_LIMIT, ge=0, le=50)):
+    # Todo el dashboard en una llamada: carteras + posiciones + historial reciente en una consulta
+    # y una sola descarga de precios para la unión de tickers de todas las carteras
+    q = (supabase.table("portfolios")
+         .select("*, items:portfolio_items(id, units_held, target_weight, asset:assets(id, name, ticker, type, sector, currency)), rebalance_history(*, items:rebalance_history_items(*))")
+         .eq("user_id", user_id).order('created_at')
+         .order('created_at', desc=True, foreign_table="rebalance_history").limit(max(history_limit, 1), foreign_table="rebalance_history"))
+    res = await q.execute()
+    bases = {p['id']: remember_currency(p['id'], p.get('base_currency')) for p in res.data}
+    prewarmer.touch(*bases)
+    rows = [i for p in res.data for i in (p.get('items') or [])]
+    prices = await run_io(fetch_live_prices, quote_tickers(rows, set(bases.values())))
+
+    portfolios = []
+    for p in res.data:
+        items = value_items(p.pop('items', None) or [], prices, bases[p['id']])
+        history = p.pop('rebalance_history', None) or []
+        portfolios.append({**p, "items": items, "total_value": round(sum(x["value"] for x in items), 2), "history": history[:history_limit]})
+    return etag_response(request, {"portfolios": portfolios, "total_value": round(sum(p["total_value"] for p in portfolios), 2)})
+
+async def value_portfolios(portfolio_ids: List[str]) -> Dict[str, List[dict]]:
+    # Posiciones de varias carteras en una consulta y precios de la unión de tickers en una descarga
+    res = await supabase.table("portfolio_items").select("id, portfolio_id, units_held, target_weight, asset:assets(id, name, ticker, type, sector, currency)").in_("portfolio_id", portfolio_ids).execute()
+    rows = [i for i in res.data if i.get('asset')]
+    bases = await portfolio_currencies(portfolio_ids)
+    prices = await run_io(fetch_live_prices, quote_tickers(rows, set(bases.values())))
+    groups = {pid: [] for pid in portfolio_ids}
+    for i in rows: groups.setdefault(i['portfolio_id'], []).append(i)
+    return {pid: value_items(g, prices, bases.get(pid, BASE_CURRENCY)) for pid, g in groups.items()}
+
+async def value_portfolios_safe(portfolio_ids: List[str]) -> Dict[str, List[dict]]:
+    # Para simulaciones: si la valoración falla, las carteras cuentan como vacías (se usa initial_capital)
+    try: return await value_portfolios(list(dict.fromkeys(portfolio_ids)))
+    except Exception as e:
+        print(f"Valuation error: {e}")
+        return {}
+
+portfolio_stream = PortfolioStream(value_portfolios, interval=STREAM_INTERVAL)
+
+@app.get("/portfolio/stream/{portfolio_id}")
+async def stream_portfolio(portfolio_id: str, request: Request):
+    # Server-Sent Events: "snapshot" al conectar y después "update" solo con las posiciones que cambian
+    prewarmer.touch(portfolio_id)
+    try: queue = await portfolio_stream.subscribe(portfolio_id)
+    except Exception as e: raise HTTPException(500, str(e))
+
+    async def events():
+        try:
+            while True:
+                try: msg = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected(): break
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {msg['type']}\ndata: {json.dumps(jsonable_encoder(msg), separators=(',', ':'), ensure_ascii=False)}\n\n"
+        finally:
+            portfolio_stream.unsubscribe(portfolio_id, queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.get("/portfolio/{portfolio_id}")
-def get_portfolio(portfolio_id: str):
+async def get_portfolio(portfolio_id: str):
+    prewarmer.touch(portfolio_id)
     try:
-        items = supabase.table("portfolio_items").select("id, units_held, target_weight, asset:assets(id, name, ticker, type, sector)").eq("portfolio_id", portfolio_id).execute()
-        data = []
-        for i in items.data:
-            if not i.get('asset'): continue
-            ticker = i['asset']['ticker']
-            price = fetch_live_price(ticker)
-            val = safe_float(float(i['units_held']) * price)
-            data.append({**i, "current_price": price, "value": round(val, 2)})
-        total = sum(x["value"] for x in data)
-        for x in data: x["real_weight"] = round(x["value"]/total*100, 2) if total > 0 else 0
-        return data
+        items, bases = await asyncio.gather(
+            supabase.table("portfolio_items").select("id, units_held, target_weight, asset:assets(id, name, ticker, type, sector, currency)").eq("portfolio_id", portfolio_id).execute(),
+            portfolio_currencies([portfolio_id]),
+        )
+        rows = [i for i in items.data if i.get('asset')]
+        prices = await run_io(fetch_live_prices, quote_tickers(rows, [bases[portfolio_id]]))
+        return value_items(rows, prices, bases[portfolio_id])
     except: return []
 
+@app.get("/portfolio/indicators/{portfolio_id}")
+async def get_portfolio_indicators(portfolio_id: str):
+    # Métricas técnicas y de riesgo de toda la cartera: histórico diario cacheado + cotización actual
+    prewarmer.touch(portfolio_id)
+    items, bases = await asyncio.gather(
+        supabase.table("portfolio_items").select("units_held, asset:assets(ticker, currency)").eq("portfolio_id", portfolio_id).execute(),
+        portfolio_currencies([portfolio_id]),
+    )
+    base = bases[portfolio_id]
+    rows = [i for i in items.data if i.get('asset') and i['asset'].get('ticker')]
+    units, currencies = {}, {}
+    for i in rows:
+        units[i['asset']['ticker']] = units.get(i['asset']['ticker'], 0.0) + safe_float(i['units_held'])
+        currencies[i['asset']['ticker']] = i['asset'].get('currency')
+    if not units: return {"assets": {}, "aggregate": None}
+    state, prices = await asyncio.gather(run_io(get_indicator_state, list(units)), run_io(fetch_live_prices, quote_tickers(rows, [base])))
+    if state is None: return {"assets": {}, "aggregate": None}
+    snap = state.preview([prices.get(t) or np.nan for t in state.tickers])
+
+    # Pesos por valor en la divisa base (los indicadores de cada activo van en su divisa de cotización)
+    values = {t: units[t] * (prices.get(t) or 0.0) * conversion_factor(currencies.get(t), base, prices) for t in snap}
+    total = sum(values.values())
+    def weighted(metric):
+        pairs = [(values[t], m[metric]) for t, m in snap.items() if m[metric] is not None]
+        w = sum(v for v, _ in pairs)
+        return round(sum(v * x for v, x in pairs) / w, 4) if w > 0 else None
+    aggregate = {"rsi": weighted("rsi"), "volatility": weighted("volatility"), "drawdown": weighted("drawdown"), "total_value": round(total, 2), "base_currency": base}
+    if aggregate["rsi"] is not None:
+        lbl, col = get_sentiment_label(aggregate["rsi"])
+        aggregate.update({"label": lbl, "color": col})
+    return {"assets": snap, "aggregate": aggregate}
+
 @app.put("/portfolio/update")
-def update_item(data: UpdateItemInput):
-    supabase.table("portfolio_items").update({"units_held": data.units_held, "target_weight": data.target_weight}).eq("id", data.item_id).execute()
+async def update_item(data: UpdateItemInput):
+    res = await supabase.table("portfolio_items").update({"units_held": data.units_held, "target_weight": data.target_weight}).eq("id", data.item_id).execute()
+    # Un cambio manual de unidades no deja rastro en el histórico: cambia toda la serie de valor
+    for r in res.data or []: value_store.invalidate(r["portfolio_id"])
     return {"msg": "OK"}
 
 @app.delete("/portfolio/delete/{item_id}")
-def delete_item(item_id: str):
-    supabase.table("portfolio_items").delete().eq("id", item_id).execute()
+async def delete_item(item_id: str):
+    res = await supabase.table("portfolio_items").delete().eq("id", item_id).execute()
+    for r in res.data or []: value_store.invalidate(r["portfolio_id"])
     return {"msg": "OK"}
 
 # --- REBALANCEO ---
 @app.post("/portfolio/rebalance")
-def calculate_rebalance(data: RebalanceInput):
-    port = get_portfolio(data.portfolio_id)
+async def calculate_rebalance(data: RebalanceInput):
+    port = await get_portfolio(data.portfolio_id)
     total = safe_float(sum(x["value"] for x in port))
     future = total + data.contribution
+    if data.mode == "solver": return solver_rebalance(port, data, total, future)
     orders = []
     for x in port:
         price = x["current_price"]
@@ -282,218 +832,366 @@ def calculate_rebalance(data: RebalanceInput):
         })
     return {"current_total": total, "contribution": data.contribution, "future_total": future, "orders": orders}
 
+def solver_rebalance(port: List[dict], data: RebalanceInput, total: float, future: float):
+    port = [x for x in port if x["current_price"] > 0]
+    values = np.array([x["value"] for x in port], dtype=np.float64)
+    weights = [float(x["target_weight"] or 0) for x in port]
+    sol = solve_rebalance(values, [x["current_price"] for x in port], weights, data.contribution,
+                          whole_units=data.whole_units, allow_sell=data.allow_sell,
+                          min_order=data.min_order, fee_fixed=data.fee_fixed, fee_rate=data.fee_rate)
+    orders = []
+    for x, units, amount, fee in zip(port, sol["units"], sol["amounts"], sol["fees"]):
+        if units == 0: continue
+        orders.append({
+            "id": x["id"],
+            "asset_name": x["asset"]["name"],
+            "ticker": x["asset"]["ticker"],
+            "action": "BUY" if units > 0 else "SELL",
+            "units_to_trade": round(float(units), 4),
+            "diff_val": round(float(amount), 2),
+            "price": x["current_price"],
+            "fee": round(float(fee), 2),
+        })
+    return {
+        "current_total": total, "contribution": data.contribution, "future_total": future, "orders": orders,
+        "fees": round(float(sol["fees"].sum()), 2), "cash_left": round(sol["cash_left"], 2),
+        "tracking_error_before": round(tracking_error(values, weights), 4), "tracking_error": round(sol["tracking_error"], 4),
+    }
+
+def _normalize_orders(orders: List[Dict[str, Any]]) -> List[dict]:
+    # Acepta snake_case y camelCase; units con signo (negativo = venta)
+    out = []
+    for order in orders:
+        out.append({
+            "id": order.get('id'),
+            "asset_name": order.get('asset_name', 'Desconocido'),
+            "ticker": order.get('ticker', ''),
+            "action": order.get('action'),
+            "units": safe_float(order.get('units_to_trade') or order.get('unitsToTrade')),
+            "amount": safe_float(order.get('diff_val') or order.get('diffVal')),
+            "price": safe_float(order.get('price')),
+        })
+    return out
+
+async def rebalance_value_before(portfolio_id: str, orders: List[dict]):
+    # Valor de toda la cartera antes del rebalanceo (no solo de las posiciones con orden): precio confirmado en la
+    # orden y, para las posiciones sin orden, la cotización actual (normalmente ya en caché por la propuesta)
+    res = await supabase.table("portfolio_items").select("id, portfolio_id, asset_id, units_held, target_weight, asset:assets(id, ticker, currency)").eq("portfolio_id", portfolio_id).execute()
+    confirmed = {o["id"]: o["price"] for o in orders if o["id"]}
+    value = sum(safe_float(r["units_held"]) * confirmed[r["id"]] for r in res.data if r["id"] in confirmed)
+    unpriced = [r for r in res.data if r["id"] not in confirmed and r.get("asset") and safe_float(r["units_held"]) > 0]
+    if unpriced:
+        base = (await portfolio_currencies([portfolio_id]))[portfolio_id]
+        prices = await run_io(fetch_live_prices, quote_tickers(unpriced, [base]))
+        value += sum(x["value"] for x in value_items(unpriced, prices, base))
+    return [{k: v for k, v in r.items() if k != "asset"} for r in res.data], value
+
+async def _shift_units(row_id: str, old, delta: float, tries: int = 3):
+    # Suma condicionada: solo escribe si units_held sigue como se leyó; si otro lo cambió entretanto se relee y se reintenta
+    for _ in range(tries):
+        new = max(0.0, safe_float(old) + delta)
+        res = await supabase.table("portfolio_items").update({"units_held": new}).eq("id", row_id).eq("units_held", old).execute()
+        if res.data: return row_id, old, new
+        cur = await supabase.table("portfolio_items").select("units_held").eq("id", row_id).execute()
+        if not cur.data: raise Exception(f"La posición {row_id} se borró durante el rebalanceo")
+        old = cur.data[0]["units_held"]
+    raise Exception(f"La posición {row_id} se está modificando a la vez; vuelve a intentarlo")
+
+async def _shift_all(shifts: List[tuple]):
+    # [(id, unidades leídas, delta)]: todas o ninguna (si una falla se devuelven las ya hechas a su valor anterior)
+    done = await asyncio.gather(*(_shift_units(*s) for s in shifts), return_exceptions=True)
+    failed = [r for r in done if isinstance(r, BaseException)]
+    if failed:
+        await asyncio.gather(*(supabase.table("portfolio_items").update({"units_held": old}).eq("id", rid).eq("units_held", new).execute()
+                               for rid, old, new in (r for r in done if not isinstance(r, BaseException))), return_exceptions=True)
+        raise failed[0]
+
+async def _apply_rebalance_bulk(portfolio_id: str, contribution: float, orders: List[dict], rows: List[dict], val_before: float):
+    # Alternativa sin RPC (no atómica, hasta desplegar sql/rebalance.sql): cabecera, items y sumas condicionadas de
+    # unidades; si algo falla se deshacen las sumas ya hechas y se borra la cabecera para no dejar historial a medias
+    current = {r["id"]: r for r in rows}
+
+    hist = await supabase.table("rebalance_history").insert({
+        "portfolio_id": portfolio_id, 
+        "contribution": contribution, 
+        "total_value_before": val_before, 
+        "total_value_after": val_before + contribution
+    }).execute()
+    hist_id = hist.data[0]['id']
+
+    moves = [o for o in orders if abs(o["units"]) > 0.00001]
+    hist_items_data = [{
+        "history_id": hist_id, "asset_name": o["asset_name"], "ticker": o["ticker"], "action": o["action"],
+        "units": abs(o["units"]), "amount": abs(o["amount"]), "price": o["price"]
+    } for o in moves]
+    try:
+        if hist_items_data: await supabase.table("rebalance_history_items").insert(hist_items_data).execute()
+        await _shift_all([(o["id"], current[o["id"]]["units_held"], o["units"]) for o in moves if o["id"] in current])
+        await supabase.table("portfolios").update({"last_contribution": contribution}).eq("id", portfolio_id).execute()
+    except Exception:
+        await supabase.table("rebalance_history").delete().eq("id", hist_id).execute()
+        raise
+    return hist_id
+
 @app.post("/portfolio/apply_rebalance")
-def apply_rebalance(data: ApplyRebalanceInput):
+async def apply_rebalance(data: ApplyRebalanceInput):
+    # Usa los precios que el cliente ya confirmó en las órdenes; solo se cotizan las posiciones que no traen orden
     try:
-        port_items = get_portfolio(data.portfolio_id)
-        val_before = sum(i['value'] for i in port_items)
-        val_after = val_before + data.contribution
-        
-        hist = supabase.table("rebalance_history").insert({
-            "portfolio_id": data.portfolio_id, 
-            "contribution": data.contribution, 
-            "total_value_before": val_before, 
-            "total_value_after": val_after
-        }).execute()
-        hist_id = hist.data[0]['id']
-        
-        hist_items_data = []
-        for order in data.orders:
-            units_diff = safe_float(order.get('units_to_trade') or order.get('unitsToTrade'))
-            diff_val = safe_float(order.get('diff_val') or order.get('diffVal'))
-            price = safe_float(order.get('price'))
-            
-            if abs(units_diff) > 0.00001:
-                hist_items_data.append({
-                    "history_id": hist_id, 
-                    "asset_name": order.get('asset_name', 'Desconocido'), 
-                    "ticker": order.get('ticker', ''), 
-                    "action": order.get('action'), 
-                    "units": abs(units_diff), 
-                    "amount": abs(diff_val), 
-                    "price": price
-                })
-                
-                item_id = order.get('id')
-                if item_id:
-                    curr = supabase.table("portfolio_items").select("units_held").eq("id", item_id).execute()
-                    if curr.data:
-                        actual = safe_float(curr.data[0]['units_held'])
-                        new_h = max(0.0, actual + units_diff)
-                        supabase.table("portfolio_items").update({"units_held": new_h}).eq("id", item_id).execute()
-        
-        if hist_items_data: 
-            supabase.table("rebalance_history_items").insert(hist_items_data).execute()
-            
-        supabase.table("portfolios").update({"last_contribution": data.contribution}).eq("id", data.portfolio_id).execute()
-        return {"msg": "Applied"}
+        orders = _normalize_orders(data.orders)
+        rows, val_before = await rebalance_value_before(data.portfolio_id, orders)
+        try:
+            hist_id = await call_rpc("apply_rebalance", {"p_portfolio_id": data.portfolio_id, "p_contribution": data.contribution, "p_orders": orders, "p_value_before": val_before})
+        except RPCUnavailable:
+            hist_id = await _apply_rebalance_bulk(data.portfolio_id, data.contribution, orders, rows, val_before)
+        # Las unidades cambian desde hoy: el pasado de la serie de valor sigue siendo válido
+        value_store.invalidate(data.portfolio_id, since=pd.Timestamp.now(tz="UTC"))
+        return {"msg": "Applied", "history_id": hist_id}
     except Exception as e:
         print(f"APPLY ERROR: {e}")
         raise HTTPException(500, str(e))
 
+async def _undo_rebalance_bulk(history_id: str):
+    # Alternativa sin RPC: cabecera + items en una consulta, ids por el índice de tickers y sumas condicionadas;
+    # la cabecera se borra solo si se han revertido todas las unidades (si no, el deshacer se puede reintentar)
+    header = await supabase.table("rebalance_history").select("portfolio_id, items:rebalance_history_items(ticker, units, action)").eq("id", history_id).execute()
+    if not header.data: raise HTTPException(404, "History not found")
+    portfolio_id = header.data[0]['portfolio_id']
+    items = header.data[0].get('items') or []
+
+    ids = await resolve_asset_ids([i['ticker'] for i in items])
+    rows = {}
+    if ids:
+        p_items = await supabase.table("portfolio_items").select("id, portfolio_id, asset_id, units_held, target_weight").eq("portfolio_id", portfolio_id).in_("asset_id", list(set(ids.values()))).execute()
+        rows = {r['asset_id']: r for r in p_items.data}
+
+    deltas = {}
+    for item in items:
+        row = rows.get(ids.get(item['ticker']))
+        if not row: continue
+        units = safe_float(item['units'])
+        deltas[row['id']] = deltas.get(row['id'], 0.0) + (-units if item['action'] == 'BUY' else units)
+    held = {r['id']: r['units_held'] for r in rows.values()}
+
+    await _shift_all([(rid, held[rid], d) for rid, d in deltas.items()])
+    await supabase.table("rebalance_history").delete().eq("id", history_id).execute()
+
 @app.post("/portfolio/history/undo")
-def undo_rebalance_operation(data: Dict[str, str]):
+async def undo_rebalance_operation(data: Dict[str, str]):
     history_id = data.get("history_id")
     if not history_id: raise HTTPException(400, "Missing history_id")
+    header = await supabase.table("rebalance_history").select("portfolio_id, created_at").eq("id", history_id).execute()
+    if not header.data: raise HTTPException(404, "History not found")
     try:
-        header = supabase.table("rebalance_history").select("portfolio_id").eq("id", history_id).execute()
-        if not header.data: raise HTTPException(404, "History not found")
-        portfolio_id = header.data[0]['portfolio_id']
-        
-        items = supabase.table("rebalance_history_items").select("*").eq("history_id", history_id).execute()
-        
-        for item in items.data:
-            ticker = item['ticker']
-            units = safe_float(item['units'])
-            action = item['action']
-            
-            asset_res = supabase.table("assets").select("id").eq("ticker", ticker).execute()
-            if not asset_res.data: continue
-            asset_id = asset_res.data[0]['id']
-            
-            p_item = supabase.table("portfolio_items").select("id, units_held").eq("portfolio_id", portfolio_id).eq("asset_id", asset_id).execute()
-            if not p_item.data: continue
-            
-            current_units = safe_float(p_item.data[0]['units_held'])
-            item_id = p_item.data[0]['id']
-            
-            if action == 'BUY':
-                new_units = max(0.0, current_units - units)
-            else:
-                new_units = current_units + units
-                
-            supabase.table("portfolio_items").update({"units_held": new_units}).eq("id", item_id).execute()
-            
-        supabase.table("rebalance_history").delete().eq("id", history_id).execute()
+        try:
+            await call_rpc("undo_rebalance", {"p_history_id": history_id})
+        except RPCUnavailable:
+            await _undo_rebalance_bulk(history_id)
+        # Se revierten las unidades desde la fecha del rebalanceo; lo anterior no cambia
+        value_store.invalidate(header.data[0]["portfolio_id"], since=header.data[0]["created_at"])
         return {"msg": "Undone successfully"}
     except Exception as e: 
         print(f"UNDO ERROR: {e}")
         raise HTTPException(500, str(e))
 
 @app.delete("/portfolio/history/delete/{history_id}")
-def delete_history_entry(history_id: str):
+async def delete_history_entry(history_id: str):
     try:
-        supabase.table("rebalance_history").delete().eq("id", history_id).execute()
+        res = await supabase.table("rebalance_history").delete().eq("id", history_id).execute()
+        # Borrar la entrada sin revertir unidades cambia las unidades reconstruidas antes de esa fecha
+        for r in res.data or []: value_store.invalidate(r["portfolio_id"])
         return {"msg": "Deleted"}
     except Exception as e: raise HTTPException(500, str(e))
 
 @app.get("/portfolio/history/{portfolio_id}")
-def get_rebalance_history(portfolio_id: str):
+async def get_rebalance_history(portfolio_id: str, response: Response, limit: Optional[int] = Query(None, ge=1, le=500), before: Optional[str] = None):
+    # Cabeceras + items en una sola consulta; paginación por cursor "created_at|id" del último devuelto
+    # (el id desempata las filas con el mismo created_at; un cursor con solo created_at sigue valiendo).
+    # Sin limit ni before se devuelve todo, como espera el cliente que no sigue X-Next-Cursor
+    if limit is None and before: limit = HISTORY_PAGE_SIZE
+    def query():
+        q = supabase.table("rebalance_history").select("*, items:rebalance_history_items(*)").eq("portfolio_id", portfolio_id)
+        if before:
+            created_at, _, last_id = before.partition("|")
+            if last_id: q = q.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{last_id}")')
+            else: q = q.lt("created_at", created_at)
+        return q.order('created_at', desc=True).order('id', desc=True)
     try:
-        hists = supabase.table("rebalance_history").select("*").eq("portfolio_id", portfolio_id).order('created_at', desc=True).execute()
-        if not hists.data: return []
-        res = []
-        for h in hists.data:
-            items = supabase.table("rebalance_history_items").select("*").eq("history_id", h['id']).execute()
-            res.append({**h, "items": items.data})
-        return res
+        if limit:
+            hists = (await query().limit(limit).execute()).data
+            if len(hists) == limit: response.headers["X-Next-Cursor"] = f'{hists[-1]["created_at"]}|{hists[-1]["id"]}'
+            return hists
+        # Todo el historial, por páginas para que max-rows de PostgREST no lo corte
+        hists, start = [], 0
+        while True:
+            page = (await query().range(start, start + POSTGREST_MAX_ROWS - 1).execute()).data
+            hists += page
+            if len(page) < POSTGREST_MAX_ROWS: return hists
+            start += POSTGREST_MAX_ROWS
     except: return []
 
 # --- CHART & NEWS (LÓGICA MEJORADA) ---
+EMPTY_CHART = {"history": [], "change_pct": 0, "change_val": 0}
+
+def chart_response(total_series: pd.Series, points: Optional[int] = None):
+    # Limpiar datos vacíos y, si se pide, reducir a `points` puntos conservando la forma (LTTB)
+    total_series = total_series[total_series > 0]
+    if total_series.empty: return dict(EMPTY_CHART)
+    if points:
+        keep = lttb(total_series.index.asi8, total_series.to_numpy(), points)
+        total_series = total_series.iloc[keep]
+
+    history = [{"date": d.isoformat(), "value": round(safe_float(v), 2)} for d, v in total_series.items()]
+
+    start = history[0]["value"]
+    end = history[-1]["value"]
+    diff = end - start
+    pct = (diff / start * 100) if start > 0 else 0
+
+    return {"history": history, "change_val": round(diff, 2), "change_pct": round(pct, 2)}
+
+async def load_value_inputs(portfolio_id: str):
+    # Posiciones actuales + movimientos del histórico en una sola consulta
+    res, bases = await asyncio.gather(
+        supabase.table("portfolios").select(
+            "items:portfolio_items(units_held, asset:assets(ticker, currency)), "
+            "history:rebalance_history(created_at, items:rebalance_history_items(ticker, action, units))"
+        ).eq("id", portfolio_id).execute(),
+        portfolio_currencies([portfolio_id]),
+    )
+    if not res.data: return {}, {}, [], bases[portfolio_id]
+    current, currencies = {}, {}
+    for i in res.data[0].get("items") or []:
+        if not i.get('asset') or not i['asset'].get('ticker'): continue
+        current[i['asset']['ticker']] = safe_float(i['units_held'])
+        currencies[i['asset']['ticker']] = i['asset'].get('currency')
+    events = []
+    for h in res.data[0].get("history") or []:
+        deltas = {}
+        for it in h.get("items") or []:
+            units = safe_float(it['units'])
+            deltas[it['ticker']] = deltas.get(it['ticker'], 0.0) + (units if it['action'] == 'BUY' else -units)
+        events.append((h['created_at'], deltas))
+    # Activos que ya no están en la cartera pero aparecen en el histórico
+    gone = [t for _, d in events for t in d if t and t not in currencies]
+    if gone:
+        assets = await supabase.table("assets").select("ticker, currency").in_("ticker", list(dict.fromkeys(gone))).execute()
+        for a in assets.data: currencies[a['ticker']] = a.get('currency')
+    return current, currencies, events, bases[portfolio_id]
+
+def build_value_series(portfolio_id: str, version: int, current: dict, currencies: dict, events: list, base: str):
+    # Cierres diarios del HistoryStore (activos + tipos de cambio del día) x unidades de cada fecha
+    factors = {t: (fx_ticker(c, base), split_currency(c, base)[1]) for t, c in currencies.items()}
+    tickers = list(factors) + list(dict.fromkeys(pair for pair, _ in factors.values() if pair))
+    history_store.sync(tickers, "1d", _fetch_bars)
+    # Si falló la descarga de algún ticker no se guarda nada: la serie sigue caducada y se reintenta en la próxima lectura
+    if not all(history_store.is_fresh(t, "1d") for t in tickers): return
+    closes = history_store.closes(tickers, "1d", start=value_store.tail_start(portfolio_id))
+    if closes.empty: return
+    value_store.write(portfolio_id, value_points(closes, current, factors, events), version)
+
+value_builds: Dict[str, asyncio.Task] = {}
+
+async def _refresh_value_series(portfolio_id: str):
+    try:
+        version = value_store.version(portfolio_id)
+        current, currencies, events, base = await load_value_inputs(portfolio_id)
+        if currencies: await run_io(build_value_series, portfolio_id, version, current, currencies, events, base)
+    except Exception as e:
+        # Se sirve la serie guardada (aunque le falte la cola) y se reintenta en la próxima lectura
+        print(f"Value series error: {e}")
+    finally:
+        value_builds.pop(portfolio_id, None)
+
+async def portfolio_value_series(portfolio_id: str) -> pd.Series:
+    # Solo se recalcula la cola cuando caduca o tras invalidarla; peticiones simultáneas comparten el cálculo
+    if not value_store.is_fresh(portfolio_id):
+        task = value_builds.get(portfolio_id)
+        if task is None: task = value_builds[portfolio_id] = asyncio.ensure_future(_refresh_value_series(portfolio_id))
+        await asyncio.shield(task)
+    return value_store.series(portfolio_id)
+
 @app.post("/portfolio/history_chart")
-def get_chart_data(data: HistoryInput):
+async def get_chart_data(data: HistoryInput):
+    prewarmer.touch(data.portfolio_id)
     try:
-        items = supabase.table("portfolio_items").select("units_held, asset:assets(ticker)").eq("portfolio_id", data.portfolio_id).gt("units_held", 0).execute()
-        
-        if not items.data: return {"history": [], "change_pct": 0, "change_val": 0}
-        
-        tickers_map = {}
-        for i in items.data:
-            if i.get('asset') and i['asset'].get('ticker'):
-                tickers_map[i['asset']['ticker']] = float(i['units_held'])
-        
-        if not tickers_map: return {"history": [], "change_pct": 0, "change_val": 0}
-        
         # Ajustar intervalo según periodo para mejor resolución
         interval = "1d"
         if data.period in ["1d", "5d"]: interval = "15m"
         elif data.period in ["1mo", "3mo"]: interval = "1h"
-        
-        df = yf.download(list(tickers_map.keys()), period=data.period, interval=interval, progress=False)["Close"]
-        
-        # Normalización robusta
-        if isinstance(df, pd.Series): 
-            df = df.to_frame(name=list(tickers_map.keys())[0])
-        elif len(tickers_map) == 1:
-            df.columns = [list(tickers_map.keys())[0]]
-            
-        # Eliminar zona horaria y rellenar huecos
-        df.index = df.index.tz_localize(None)
-        df = df.ffill().bfill().fillna(0) # CRÍTICO: Rellena hacia adelante y atrás para evitar ceros
 
-        # Calcular total
-        total_series = pd.Series(0.0, index=df.index)
-        for ticker, units in tickers_map.items():
-            if ticker in df.columns:
-                total_series += df[ticker] * units
-                
-        # Limpiar datos vacíos
-        total_series = total_series[total_series > 0]
+        # Rangos largos: serie diaria precalculada con las unidades de cada fecha (incluye los rebalanceos)
+        if interval == "1d":
+            series = await portfolio_value_series(data.portfolio_id)
+            if series.empty: return dict(EMPTY_CHART)
+            return chart_response(series[series.index >= _period_start(data.period, series.index)], data.points)
+
+        items, bases = await asyncio.gather(
+            supabase.table("portfolio_items").select("units_held, asset:assets(ticker, currency)").eq("portfolio_id", data.portfolio_id).gt("units_held", 0).execute(),
+            portfolio_currencies([data.portfolio_id]),
+        )
         
-        if total_series.empty: return {"history": [], "change_pct": 0, "change_val": 0}
+        if not items.data: return dict(EMPTY_CHART)
+        
+        tickers_map = {}
+        rows = [i for i in items.data if i.get('asset') and i['asset'].get('ticker')]
+        for i in rows:
+            tickers_map[i['asset']['ticker']] = float(i['units_held'])
         
-        history = [{"date": d.isoformat(), "value": round(safe_float(v), 2)} for d, v in total_series.items()]
+        if not tickers_map: return dict(EMPTY_CHART)
+
+        # Conversión a la divisa base con el tipo de cambio actual (aproximación: no se usa el histórico de FX)
+        base = bases[data.portfolio_id]
+        fx_prices = await run_io(fetch_live_prices, fx_tickers((i['asset'].get('currency'), base) for i in rows))
+        for i in rows:
+            tickers_map[i['asset']['ticker']] *= conversion_factor(i['asset'].get('currency'), base, fx_prices)
         
-        start = history[0]["value"]
-        end = history[-1]["value"]
-        diff = end - start
-        pct = (diff / start * 100) if start > 0 else 0
+        # Barras del almacén local; solo se pide a Yahoo lo que falta desde la última barra guardada
+        df = await run_io(load_chart_closes, list(tickers_map.keys()), interval, data.period)
+        if df.empty: return dict(EMPTY_CHART)
         
-        return {"history": history, "change_val": round(diff, 2), "change_pct": round(pct, 2)}
+        # Rellenar huecos
+        df = df.ffill().bfill().fillna(0) # CRÍTICO: Rellena hacia adelante y atrás para evitar ceros
+
+        # Total intradía con las unidades actuales, como producto matriz-vector
+        cols = [t for t in tickers_map if t in df.columns]
+        total_series = pd.Series(df[cols].to_numpy() @ np.array([tickers_map[t] for t in cols]), index=df.index)
+        return chart_response(total_series, data.points)
     except Exception as e:
         print(f"Chart Error: {e}")
-        return {"history": [], "change_pct": 0, "change_val": 0}
+        return dict(EMPTY_CHART)
 
 @app.post("/portfolio/news")
-def get_news(data: NewsInput):
+async def get_news(data: NewsInput):
     news_map = {}
     sentiments = {}
     total_score = 0; count = 0
-    import re
-    
-    def clean_asset_name(name, ticker):
-        # 1. Remove common ETF/fund terms
-        cleaned = re.sub(r'(?i)(UCITS|ETF|Acc|Dist|EUR|USD|Class|\(.*\)|Corp|Bond|Index|Fund|iShares|Vanguard|Amundi|Xtrackers|SPDR|Invesco)', '', name)
-        # 2. Remove extra spaces
-        cleaned = " ".join(cleaned.split())
-        # 3. If result is too short, use ticker, else use cleaned name
-        return cleaned if len(cleaned) > 3 else ticker
-
-    for asset in data.assets:
-        ticker = asset.get('ticker')
-        name = asset.get('name', '')
-        if not ticker: continue
-        
-        query_term = clean_asset_name(name, ticker)
-        
-        # Search for the asset name + "finance" or "stock"
-        rss_url = f"https://news.google.com/rss/search?q={urllib.parse.quote(query_term + ' finance news')}&hl=en-US&gl=US&ceid=US:en"
-        
-        try:
-            feed = feedparser.parse(rss_url)
-            items = []
-            for e in feed.entries[:4]: # Limit to 4 items per asset
-                items.append({
-                    "title": e.title, 
-                    "link": e.link, 
-                    "publisher": e.source.title if hasattr(e,'source') else "News", 
-                    "time": e.published if hasattr(e,'published') else "Reciente"
-                })
-            news_map[ticker] = items
-        except: news_map[ticker] = []
-        
-        # RSI Logic remains as requested
-        score = calculate_rsi(ticker)
+    partial = False
+
+    assets = {a['ticker']: a.get('name', '') for a in data.assets if a.get('ticker')}
+    tickers = list(assets)
+    # Feeds en paralelo (NEWS_CONCURRENCY) y RSI de todos los tickers en una descarga, a la vez
+    rsi_task = asyncio.ensure_future(asyncio.wait_for(run_io(get_indicators, tickers), NEWS_RSI_TIMEOUT))
+    feeds = await asyncio.gather(*(fetch_news_feed(news_feed_url(assets[t], t)) for t in tickers))
+    try: indicators = await rsi_task
+    except Exception as e:
+        print(f"News RSI error: {e!r}")
+        indicators = {}; partial = True
+
+    for ticker, items in zip(tickers, feeds):
+        if items is None: partial = True
+        news_map[ticker] = items or []
+        rsi = indicators.get(ticker, {}).get("rsi")
+        score = round(rsi) if rsi is not None else 50
         lbl, col = get_sentiment_label(score)
         sentiments[ticker] = {"score": score, "label": lbl, "color": col}
         total_score += score; count += 1
         
     avg = round(total_score/count) if count > 0 else 50
     albl, acol = get_sentiment_label(avg)
-    return {"news": news_map, "sentiments": sentiments, "aggregate": {"score": avg, "label": albl, "color": acol}}
+    return {"news": news_map, "sentiments": sentiments, "aggregate": {"score": avg, "label": albl, "color": acol}, "partial": partial}
 
 @app.post("/simulations/run")
-def run_sim(data: SimulationInput):
+async def run_sim(data: SimulationInput):
     results = []
     base_rate = 0.07 
     volatility = 0.0 
@@ -504,39 +1202,96 @@ def run_sim(data: SimulationInput):
     monthly_rate = base_rate / 12
     monthly_vol = volatility / (12 ** 0.5)
     
+    # La matriz de crecimientos es meses x caminos: se recortan los caminos para acotar la memoria
+    paths = max(1, min(data.paths, MAX_SIM_PATHS, MAX_SIM_CELLS // max(1, data.years * 12)))
+    valued = await value_portfolios_safe(data.portfolio_ids)
     for pid in data.portfolio_ids:
-        port = get_portfolio(pid)
+        port = valued.get(pid, [])
         current_val = sum(x['value'] for x in port)
         if current_val == 0: current_val = data.initial_capital
         
-        points = []
-        curr = current_val
-        invested = current_val
-        monthly_contrib = data.monthly_contribution
-        
-        for m in range(data.years * 12 + 1):
-            if m > 0:
-                if data.contribution_mode == 'growing' and m % 12 == 0:
-                    monthly_contrib *= (1 + (data.growth_rate / 100))
-                
-                pct_change = monthly_rate
-                if data.sim_type == 'montecarlo':
-                    pct_change += np.random.normal(0, monthly_vol)
-                
-                curr = curr * (1 + pct_change) + monthly_contrib
-                invested += monthly_contrib
-            
-            if m % 12 == 0: 
-                points.append({"year": m/12, "value": round(curr)})
-        
-        gain = curr - invested
-        tax_paid = 0
-        if data.tax_rate and gain > 0: tax_paid = gain * 0.19 
-        final_net = curr - tax_paid
+        if data.sim_type in ('historical', 'covariance'):
+            stats = await run_io(get_return_stats, [x['asset']['ticker'] for x in port])
+            weights = portfolio_weights(port, stats["tickers"]) if stats else None
+            if weights is not None:
+                sim = await run_cpu(run_historical_projection, current_val, data.years, data.monthly_contribution, data.contribution_mode,
+                                    data.growth_rate, stats, weights, data.sim_type, paths, data.tax_rate, data.target_value, data.seed)
+                results.append({"portfolio_id": pid, "portfolio_name": "Cartera", **sim})
+                continue
+            # Sin histórico utilizable: Monte Carlo con los parámetros por defecto
+            monthly_vol = 0.15 / (12 ** 0.5)
         
-        results.append({ 
-            "portfolio_id": pid, "portfolio_name": "Cartera", 
-            "data": points, "final_gross": round(curr), "final_net": round(final_net), 
-            "total_invested": round(invested), "tax_paid": round(tax_paid), "gain": round(gain) 
-        })
-    return results
\ No newline at end of file
+        sim = await run_cpu(run_projection, current_val, data.years, data.monthly_contribution, data.contribution_mode,
+                            data.growth_rate, monthly_rate, monthly_vol, paths, data.tax_rate, data.target_value, data.seed)
+        results.append({"portfolio_id": pid, "portfolio_name": "Cartera", **sim})
+    return results
+
+@app.post("/simulations/batch")
+async def run_sim_batch(data: SimulationGridInput):
+    # Rejilla de escenarios x carteras en una sola pasada vectorizada; valores iniciales con una valoración por lotes
+    ids = list(dict.fromkeys(data.portfolio_ids))
+    axes = (ids, data.annual_returns, data.volatilities, data.contribution_modes, data.monthly_contributions, data.years, data.tax_rate)
+    if not all(axes): raise HTTPException(400, "Todos los ejes de la rejilla necesitan al menos un valor")
+    if min(data.years) < 1 or max(data.years) > MAX_SIM_YEARS: raise HTTPException(400, f"years debe estar entre 1 y {MAX_SIM_YEARS}")
+    # Por camino: la matriz de aleatorios (meses) o los arrays de valores de cada escenario y plazo, lo que ocupe más
+    per_path = max(GRID_ARRAYS * math.prod(len(a) for a in axes[:-1]), max(data.years) * 12)
+    if per_path > MAX_GRID_CELLS: raise HTTPException(400, f"Rejilla demasiado grande ({per_path} celdas por camino)")
+    paths = max(1, min(data.paths, MAX_SIM_PATHS, MAX_GRID_CELLS // per_path))
+
+    valued = await value_portfolios_safe(ids)
+    start_values = [sum(x['value'] for x in valued.get(pid, [])) or data.initial_capital for pid in ids]
+    return await run_cpu(run_grid, ids, start_values, data.annual_returns, data.volatilities, data.contribution_modes,
+                         data.monthly_contributions, data.years, data.tax_rate, data.growth_rate, paths, data.target_value, data.seed)
+
+# --- PRE-CALENTAMIENTO ---
+def batches(items: list, size: int = PREWARM_BATCH):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+async def active_holdings(portfolio_ids: List[str]):
+    # Activos de las carteras activas en una consulta (+ divisas base para los tipos de cambio)
+    res, bases = await asyncio.gather(
+        supabase.table("portfolio_items").select("portfolio_id, asset:assets(ticker, name, currency)").in_("portfolio_id", portfolio_ids).execute(),
+        portfolio_currencies(portfolio_ids),
+    )
+    return [i for i in res.data if i.get('asset') and i['asset'].get('ticker')], bases
+
+async def prewarm_quotes(portfolio_ids: List[str]):
+    # Se piden antes de que caduquen en la caché, en lotes y con pausa entre ellos
+    if market.state == "open": return
+    rows, bases = await active_holdings(portfolio_ids)
+    for batch in batches(quote_tickers(rows, set(bases.values()))):
+        for t, p in (await run_io(_download_quotes, batch)).items(): quote_cache.set(t, p)
+        await prewarmer.pace()
+
+async def prewarm_bars(portfolio_ids: List[str]):
+    # Cola de barras de los gráficos (solo se descarga lo que falta) y serie de valor diaria de cada cartera
+    if market.state == "open": return
+    rows, _ = await active_holdings(portfolio_ids)
+    tickers = list(dict.fromkeys(i['asset']['ticker'] for i in rows))
+    for interval in ("15m", "1h", "1d"):
+        for batch in batches(tickers):
+            await run_io(history_store.sync, batch, interval, _fetch_bars)
+            await prewarmer.pace()
+    for pid in portfolio_ids:
+        if not value_store.is_fresh(pid):
+            await portfolio_value_series(pid)
+            await prewarmer.pace()
+
+async def prewarm_news(portfolio_ids: List[str]):
+    # RSI del día (caché diaria) y feeds RSS renovados antes de caducar, NEWS_CONCURRENCY a la vez
+    rows, _ = await active_holdings(portfolio_ids)
+    assets = {i['asset']['ticker']: i['asset'].get('name') or '' for i in rows}
+    if market.state != "open":
+        for batch in batches(list(assets)):
+            await run_io(get_indicators, batch)
+            await prewarmer.pace()
+    urls = list(dict.fromkeys(news_feed_url(name, t) for t, name in assets.items()))
+    for batch in batches(urls, NEWS_CONCURRENCY):
+        feeds = await asyncio.gather(*(_load_news_feed(u) for u in batch), return_exceptions=True)
+        for url, items in zip(batch, feeds):
+            if items is not None and not isinstance(items, BaseException): news_cache.set(url, items)
+        await prewarmer.pace()
+
+prewarmer.add_job("quotes", QUOTE_CACHE_TTL * 0.8, prewarm_quotes)
+prewarmer.add_job("bars", PREWARM_BARS_INTERVAL, prewarm_bars)
+prewarmer.add_job("news", NEWS_CACHE_TTL * 0.8, prewarm_news)
@@ -0,0 +1,323 @@
+import os
+import re
+import json
+import time
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FutureTimeout
+from typing import Dict, List
+import numpy as np
+import pandas as pd
+from metrics import track, bind
+
+FIELDS = ("Open", "High", "Low", "Close", "Volume")
+
+class MarketDataError(Exception):
+    pass
+
+class MarketDataUnavailable(MarketDataError):
+    """El upstream no responde a tiempo o el circuito está abierto."""
+
+class NoData(MarketDataError):
+    """El upstream respondió pero sin datos para lo pedido (ticker inválido o deslistado, fondo sin barras
+    intradía, fixture inexistente). No cuenta como caída."""
+
+class EmptyResponse(MarketDataError):
+    """Un lote de varios tickers sin ninguna fila ni precio: en Yahoo es lo que se ve con throttling o errores
+    (yf.download captura el error de cada ticker y devuelve un frame vacío). Cuenta como fallo del upstream."""
+
+def _empty(tickers: List[str], what: str) -> MarketDataError:
+    # Un solo ticker vacío suele ser un ticker malo, no una caída: no debe abrir el circuito para todos
+    return (EmptyResponse if len(tickers) > 1 else NoData)(f"Sin {what} para {tickers}")
+
+def _as_multi(df: pd.DataFrame, tickers: List[str]) -> pd.DataFrame:
+    # Columnas (campo, ticker) aunque se haya pedido un solo ticker; índice sin zona horaria en diario
+    if not isinstance(df.columns, pd.MultiIndex):
+        df = df.copy()
+        df.columns = pd.MultiIndex.from_product([df.columns, tickers[:1]])
+    return df
+
+class MarketDataProvider(ABC):
+    """Interfaz común de datos de mercado. Todas las operaciones son por lotes y bloqueantes (se llaman desde run_io).
+    Un backend al que le falte alguna de las cuatro falla al instanciarse.
+
+    - quotes(tickers) -> {ticker: precio}, solo los que se han podido obtener
+    - history(tickers, interval, period=None, start=None) -> DataFrame OHLCV con columnas (campo, ticker)
+    - search(q, limit) -> [{"symbol", "shortname", "longname", "quoteType", "exchange"}]
+    - info(ticker) -> dict de metadatos al estilo de Yahoo (longName, quoteType, sector, country, currency)
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def quotes(self, tickers: List[str]) -> Dict[str, float]: ...
+    @abstractmethod
+    def history(self, tickers: List[str], interval: str = "1d", period: str = None, start=None) -> pd.DataFrame: ...
+    @abstractmethod
+    def search(self, q: str, limit: int = 8) -> list: ...
+    @abstractmethod
+    def info(self, ticker: str) -> dict: ...
+
+    def closes(self, tickers: List[str], period: str, interval: str = "1d") -> pd.DataFrame:
+        """Cierres con una columna por ticker e índice sin zona horaria."""
+        tickers = list(tickers)
+        df = self.history(tickers, interval, period=period)["Close"]
+        if isinstance(df, pd.Series): df = df.to_frame(name=tickers[0])
+        df.index = df.index.tz_localize(None) if df.index.tz is not None else df.index
+        return df
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+class YFinanceProvider(MarketDataProvider):
+    """Yahoo Finance vía yfinance: una descarga multi-ticker por lote y cotización individual para lo que falte."""
+
+    name = "yfinance"
+
+    def __init__(self, fallback_workers: int = 8):
+        import yfinance
+        self.yf = yfinance
+        self.fallback_workers = fallback_workers
+        self.quote_errors = 0
+        self._lock = threading.Lock()
+
+    def history(self, tickers, interval="1d", period=None, start=None):
+        tickers = list(tickers)
+        kwargs = {"period": period} if start is None else {"start": pd.Timestamp(start)}
+        with track("yf.download"): df = self.yf.download(tickers, interval=interval, progress=False, **kwargs)
+        if df is None or df.empty: raise _empty(tickers, "histórico")
+        return _as_multi(df, tickers)
+
+    def _quote_one(self, ticker: str):
+        # None si falla (se cuenta en quote_errors) para no confundir un error con un precio ausente
+        try:
+            t = self.yf.Ticker(ticker)
+            with track("yf.quote"): price = t.fast_info.last_price
+            if price is None:
+                with track("yf.history"): hist = t.history(period="1d")
+                if not hist.empty: price = hist["Close"].iloc[-1]
+            return float(price) if price is not None else 0.0
+        except Exception:
+            with self._lock: self.quote_errors += 1
+            return None
+
+    def quotes(self, tickers):
+        tickers = list(tickers)
+        # Si el lote falla o viene vacío se propaga sin repartir N llamadas por ticker
+        try: last = self.closes(tickers, "5d").ffill().iloc[-1]
+        except NoData: last = pd.Series(dtype=float)  # un solo ticker sin barras: se intenta su cotización suelta
+        prices = {}
+        for t in tickers:
+            p = last.get(t)
+            if p is not None and np.isfinite(p) and p > 0: prices[t] = float(p)
+        # El upstream respondió: lo que falte en el lote se pide por separado, en paralelo
+        missing = [t for t in tickers if t not in prices]
+        if missing:
+            with ThreadPoolExecutor(max_workers=min(self.fallback_workers, len(missing))) as pool:
+                for t, p in zip(missing, pool.map(bind(self._quote_one), missing)):
+                    if p is not None and np.isfinite(p) and p > 0: prices[t] = p
+        if not prices: raise _empty(tickers, "cotizaciones")
+        return prices
+
+    def search(self, q, limit=8):
+        with track("yf.search"): return list(self.yf.Search(q, max_results=limit).quotes)
+
+    def info(self, ticker):
+        with track("yf.info"): return self.yf.Ticker(ticker).info
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "quote_errors": self.quote_errors}
+
+_PERIOD_UNITS = {"d": "days", "wk": "weeks", "mo": "months", "y": "years"}
+
+def _period_begin(period: str, end: pd.Timestamp) -> pd.Timestamp:
+    m = re.match(r"(\d+)(d|wk|mo|y)$", period)
+    if period == "ytd": return pd.Timestamp(end.year, 1, 1)
+    if not m: return end - pd.DateOffset(years=1)
+    n, unit = int(m.group(1)), m.group(2)
+    return end - pd.DateOffset(**{_PERIOD_UNITS[unit]: n})
+
+class FixtureProvider(MarketDataProvider):
+    """Datos locales para desarrollo y pruebas sin red.
+
+    root/history/<TICKER>.csv (Date,Open,High,Low,Close,Volume; opcional <TICKER>@<intervalo>.csv para intradía),
+    root/search.json (lista de resultados al estilo de Yahoo) y root/info.json ({ticker: info}).
+    """
+
+    name = "fixtures"
+
+    def __init__(self, root: str):
+        self.root = root
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def _json(self, name, default):
+        path = os.path.join(self.root, name)
+        if not os.path.exists(path): return default
+        with open(path, encoding="utf-8") as f: return json.load(f)
+
+    def _frame(self, ticker: str, interval: str):
+        key = (ticker, interval)
+        with self._lock:
+            if key not in self._frames:
+                base = os.path.join(self.root, "history", ticker)
+                path = f"{base}@{interval}.csv" if os.path.exists(f"{base}@{interval}.csv") else f"{base}.csv"
+                self._frames[key] = pd.read_csv(path, index_col=0, parse_dates=True) if os.path.exists(path) else None
+            return self._frames[key]
+
+    def history(self, tickers, interval="1d", period=None, start=None):
+        cols = {}
+        for t in tickers:
+            df = self._frame(t, interval)
+            if df is None or df.empty: continue
+            if start is not None: df = df[df.index >= pd.Timestamp(start)]
+            elif period and period != "max":
+                df = df[df.index >= _period_begin(period, df.index[-1])]
+            for field in FIELDS:
+                if field in df.columns: cols[(field, t)] = df[field]
+        if not cols: raise NoData(f"Sin fixtures para {list(tickers)}")
+        return pd.DataFrame(cols).sort_index()
+
+    def quotes(self, tickers):
+        out = {}
+        for t in tickers:
+            df = self._frame(t, "1d")
+            if df is not None and not df.empty: out[t] = float(df["Close"].dropna().iloc[-1])
+        return out
+
+    def search(self, q, limit=8):
+        q = q.lower()
+        hits = [r for r in self._json("search.json", []) if q in r.get("symbol", "").lower() or q in (r.get("shortname") or "").lower()]
+        return hits[:limit]
+
+    def info(self, ticker):
+        return self._json("info.json", {}).get(ticker) or {}
+
+class ResilientProvider(MarketDataProvider):
+    """Envuelve otro proveedor con timeout por llamada, circuit breaker, coalescing y últimos precios conocidos.
+
+    - Cada llamada espera como mucho `timeout` segundos; si vence, la llamada sigue en segundo plano y su
+      resultado (si llega) refresca los últimos precios conocidos (stale-while-revalidate).
+    - Tras `threshold` fallos seguidos el circuito se abre `cooldown` segundos y las llamadas fallan al instante;
+      después se deja pasar una sola de prueba (semiabierto).
+    - Llamadas idénticas simultáneas comparten la misma petición al upstream.
+    - `last_quotes` devuelve la última cotización buena de cada ticker para servirla cuando el upstream falla.
+    """
+
+    def __init__(self, inner: MarketDataProvider, timeout: float = 10.0, threshold: int = 5, cooldown: float = 30.0, workers: int = 16):
+        self.inner = inner
+        self.name = inner.name
+        self.timeout = timeout
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="market")
+        self._lock = threading.Lock()
+        self._inflight = {}  # clave -> Future
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._last = {}  # ticker -> (precio, time.time())
+        self.counters = {"calls": 0, "coalesced": 0, "timeouts": 0, "failures": 0, "rejected": 0, "stale_quotes": 0}
+
+    # --- Circuit breaker ---
+    @property
+    def state(self) -> str:
+        if self._opened_at is None: return "closed"
+        return "half-open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+    def _admit(self):
+        with self._lock:
+            state = self.state
+            if state == "closed": return
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return
+            self.counters["rejected"] += 1
+        raise MarketDataUnavailable(f"{self.name}: circuito abierto")
+
+    def _record(self, ok: bool):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            self.counters["failures"] += 1
+            if self._failures >= self.threshold or self._opened_at is not None:
+                if self._opened_at is None: print(f"⚠️ Market data {self.name}: circuito abierto tras {self._failures} fallos")
+                self._opened_at = time.monotonic()
+
+    def _done(self, key, fut: Future):
+        with self._lock: self._inflight.pop(key, None)
+        exc = None if fut.cancelled() else fut.exception()
+        ok = exc is None or isinstance(exc, NoData)
+        # Un fallo tras vencer el timeout ya se contó al vencer
+        if ok or not getattr(fut, "timed_out", False): self._record(ok)
+
+    def _call(self, key, fn, *args):
+        self._admit()
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                self.counters["coalesced"] += 1
+                new = False
+            else:
+                self.counters["calls"] += 1
+                fut = self._inflight[key] = self._pool.submit(bind(fn), *args)
+                new = True
+        # Fuera del lock: si la llamada ya terminó, el callback se ejecuta aquí mismo y toma el lock
+        if new: fut.add_done_callback(lambda f: self._done(key, f))
+        try:
+            return fut.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.counters["timeouts"] += 1
+                first = not getattr(fut, "timed_out", False)
+                fut.timed_out = True
+            if first: self._record(False)
+            raise MarketDataUnavailable(f"{self.name}: timeout de {self.timeout}s")
+
+    # --- Operaciones ---
+    def _remember(self, prices: Dict[str, float]):
+        now = time.time()
+        with self._lock:
+            for t, p in prices.items(): self._last[t] = (p, now)
+
+    def _fetch_quotes(self, tickers):
+        prices = self.inner.quotes(tickers)
+        self._remember(prices)  # también cuando la llamada llega tarde (tras el timeout)
+        return prices
+
+    def quotes(self, tickers):
+        tickers = list(dict.fromkeys(tickers))
+        return self._call(("quotes", tuple(sorted(tickers))), self._fetch_quotes, tickers)
+
+    def last_quotes(self, tickers) -> Dict[str, float]:
+        """Última cotización buena conocida (puede estar desfasada)."""
+        with self._lock:
+            out = {t: self._last[t][0] for t in tickers if t in self._last}
+            self.counters["stale_quotes"] += len(out)
+        return out
+
+    def history(self, tickers, interval="1d", period=None, start=None):
+        tickers = list(tickers)
+        return self._call(("history", tuple(tickers), interval, period, start), self.inner.history, tickers, interval, period, start)
+
+    def search(self, q, limit=8):
+        return self._call(("search", q, limit), self.inner.search, q, limit)
+
+    def info(self, ticker):
+        return self._call(("info", ticker), self.inner.info, ticker)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.inner.stats(), "state": self.state, "consecutive_failures": self._failures,
+                    "known_quotes": len(self._last), "inflight": len(self._inflight), **self.counters}
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+def create_provider(backend: str = "yfinance", fixtures: str = None, **resilience) -> ResilientProvider:
+    inner = FixtureProvider(fixtures) if backend == "fixtures" else YFinanceProvider()
+    return ResilientProvider(inner, **resilience)
@@ -0,0 +1,181 @@
+import time
+import bisect
+import threading
+import contextvars
+from collections import defaultdict
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class RequestStats:
+    """Llamadas a upstreams de una petición: {upstream: [llamadas, segundos, fallos]}. Thread-safe."""
+
+    def __init__(self):
+        self.calls = defaultdict(lambda: [0, 0.0, 0])
+        self._lock = threading.Lock()
+
+    def add(self, upstream: str, seconds: float, failed: bool):
+        with self._lock:
+            c = self.calls[upstream]
+            c[0] += 1; c[1] += seconds; c[2] += failed
+
+    def items(self):
+        with self._lock: return sorted((k, tuple(v)) for k, v in self.calls.items())
+
+_current: contextvars.ContextVar = contextvars.ContextVar("request_stats", default=None)
+
+class _Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(BUCKETS, value)
+        if i < len(self.buckets): self.buckets[i] += 1
+        self.count += 1
+        self.sum += value
+
+class Registry:
+    """Contadores e histogramas acumulados del proceso, exportados en formato de texto de Prometheus."""
+
+    def __init__(self, prefix: str = "fandance"):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)  # (method, route, status) -> n
+        self.request_seconds = defaultdict(_Histogram)  # route -> histograma
+        self.upstream_calls = defaultdict(int)
+        self.upstream_errors = defaultdict(int)
+        self.upstream_seconds = defaultdict(_Histogram)
+        self.slow_requests = 0
+
+    def observe_upstream(self, upstream: str, seconds: float, failed: bool):
+        with self._lock:
+            self.upstream_calls[upstream] += 1
+            if failed: self.upstream_errors[upstream] += 1
+            self.upstream_seconds[upstream].observe(seconds)
+
+    def observe_request(self, method: str, route: str, status: int, seconds: float):
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            self.request_seconds[route].observe(seconds)
+
+    def render(self, extra=()) -> str:
+        """Exposición de texto; `extra` son líneas adicionales (p. ej. estadísticas de caché)."""
+        p, out = self.prefix, []
+
+        def histogram(name, label, data):
+            out.append(f"# TYPE {name} histogram")
+            for key, h in sorted(data.items()):
+                acc = 0
+                for le, n in zip(BUCKETS, h.buckets):
+                    acc += n
+                    out.append(f'{name}_bucket{{{label}="{key}",le="{le}"}} {acc}')
+                out.append(f'{name}_bucket{{{label}="{key}",le="+Inf"}} {h.count}')
+                out.append(f'{name}_sum{{{label}="{key}"}} {h.sum:.6f}')
+                out.append(f'{name}_count{{{label}="{key}"}} {h.count}')
+
+        with self._lock:
+            out.append(f"# TYPE {p}_http_requests_total counter")
+            for (method, route, status), n in sorted(self.requests.items()):
+                out.append(f'{p}_http_requests_total{{method="{method}",route="{route}",status="{status}"}} {n}')
+            histogram(f"{p}_http_request_duration_seconds", "route", self.request_seconds)
+            out.append(f"# TYPE {p}_http_slow_requests_total counter")
+            out.append(f"{p}_http_slow_requests_total {self.slow_requests}")
+            out.append(f"# TYPE {p}_upstream_calls_total counter")
+            for k, n in sorted(self.upstream_calls.items()): out.append(f'{p}_upstream_calls_total{{upstream="{k}"}} {n}')
+            out.append(f"# TYPE {p}_upstream_errors_total counter")
+            for k, n in sorted(self.upstream_errors.items()): out.append(f'{p}_upstream_errors_total{{upstream="{k}"}} {n}')
+            histogram(f"{p}_upstream_duration_seconds", "upstream", self.upstream_seconds)
+        out.extend(extra)
+        return "\n".join(out) + "\n"
+
+registry = Registry()
+
+class track:
+    """`with track("yf.download"): ...` mide la llamada y la anota en la petición actual y en el registro.
+
+    Una excepción que atraviesa el bloque cuenta como fallo (aunque luego el llamador la silencie).
+    """
+
+    __slots__ = ("upstream", "t0")
+
+    def __init__(self, upstream: str):
+        self.upstream = upstream
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.t0
+        failed = exc_type is not None and not issubclass(exc_type, GeneratorExit)
+        registry.observe_upstream(self.upstream, seconds, failed)
+        stats = _current.get()
+        if stats is not None: stats.add(self.upstream, seconds, failed)
+        return False
+
+def bind(fn):
+    """`fn` ejecutándose con el contexto (petición actual) del llamador, para pasarla a otro hilo."""
+    ctx = contextvars.copy_context()
+    return lambda *args: ctx.copy().run(fn, *args)
+
+class _Traced:
+    """Proxy de un cliente/builder de supabase-py que mide cada `execute()` como upstream `name`."""
+
+    __slots__ = ("_obj", "_name")
+
+    def __init__(self, obj, name: str):
+        self._obj = obj
+        self._name = name
+
+    def __getattr__(self, attr):
+        value = getattr(self._obj, attr)
+        if attr == "execute":
+            async def execute(*args, **kwargs):
+                with track(self._name): return await value(*args, **kwargs)
+            return execute
+        if not callable(value): return value
+        def call(*args, **kwargs):
+            out = value(*args, **kwargs)
+            return _Traced(out, self._name) if hasattr(out, "execute") or hasattr(out, "table") else out
+        return call
+
+def instrument_supabase(client, name: str = "supabase"):
+    return _Traced(client, name)
+
+class MetricsMiddleware:
+    """Middleware ASGI: estadísticas por petición, cabecera Server-Timing y log de peticiones lentas."""
+
+    def __init__(self, app, slow_ms: float = 1000.0, log=print):
+        self.app = app
+        self.slow_ms = slow_ms
+        self.log = log
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _current.set(stats)
+        t0 = time.perf_counter()
+        status, streaming = [500], [False]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                streaming[0] = any(k == b"content-type" and v.startswith(b"text/event-stream") for k, v in message.get("headers", []))
+                timing = [f'{k};dur={s * 1000:.1f};desc="{n} calls{f", {e} failed" if e else ""}"' for k, (n, s, e) in stats.items()]
+                timing.append(f"app;dur={(time.perf_counter() - t0) * 1000:.1f}")
+                message["headers"] = list(message.get("headers", [])) + [(b"server-timing", ", ".join(timing).encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            seconds = time.perf_counter() - t0
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            registry.observe_request(scope["method"], route, status[0], seconds)
+            if seconds * 1000 >= self.slow_ms and not streaming[0]:
+                with registry._lock: registry.slow_requests += 1
+                breakdown = " ".join(f"{k}={n}/{s * 1000:.0f}ms" + (f"/{e}err" if e else "") for k, (n, s, e) in stats.items()) or "sin upstreams"
+                self.log(f"🐢 Slow request {scope['method']} {scope['path']} {seconds * 1000:.0f} ms: {breakdown}")
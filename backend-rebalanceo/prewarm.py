@@ -0,0 +1,74 @@
+import time
+import random
+import asyncio
+
+class Prewarmer:
+    """Refresco en segundo plano de los datos de las carteras usadas recientemente.
+
+    Las peticiones marcan sus carteras con `touch`; cada trabajo registrado con `add_job` se ejecuta cada
+    `interval` segundos (con jitter) como `await fn(portfolio_ids)` sobre las carteras activas en la ventana
+    `active_for`. Cada trabajo tiene su propia tarea, así que uno lento no retrasa a los demás, y dentro de
+    él `pace()` espacia los lotes para no competir con las peticiones interactivas por la cuota de los
+    upstreams. Un fallo no detiene el bucle.
+    """
+
+    def __init__(self, active_for: float = 1800, max_portfolios: int = 200, pause: float = 2.0, jitter: float = 0.2):
+        self.active_for = active_for
+        self.max_portfolios = max_portfolios
+        self.pause = pause
+        self.jitter = jitter
+        self._seen = {}  # portfolio_id -> time.monotonic() de la última petición
+        self._jobs = []  # [nombre, intervalo, fn, próxima ejecución]
+        self._tasks = []
+        self.runs = {}
+        self.errors = {}
+
+    def touch(self, *portfolio_ids):
+        now = time.monotonic()
+        for pid in portfolio_ids:
+            if pid: self._seen[pid] = now
+
+    def active(self) -> list:
+        """Carteras vistas dentro de la ventana, las más recientes primero (como mucho `max_portfolios`)."""
+        limit = time.monotonic() - self.active_for
+        for pid in [p for p, t in self._seen.items() if t < limit]: del self._seen[pid]
+        return sorted(self._seen, key=self._seen.get, reverse=True)[:self.max_portfolios]
+
+    def _spread(self, seconds: float) -> float:
+        return seconds * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def add_job(self, name: str, interval: float, fn):
+        self._jobs.append([name, interval, fn, time.monotonic() + self._spread(interval)])
+
+    async def pace(self):
+        """Pausa entre lotes de un trabajo (limita la tasa de llamadas al upstream)."""
+        if self.pause > 0: await asyncio.sleep(self._spread(self.pause))
+
+    async def run_job(self, job):
+        name, interval, fn, _ = job
+        ids = self.active()
+        if ids:
+            try: await fn(ids)
+            except asyncio.CancelledError: raise
+            except Exception as e:
+                self.errors[name] = self.errors.get(name, 0) + 1
+                print(f"Prewarm {name} error: {e}")
+            self.runs[name] = self.runs.get(name, 0) + 1
+        job[3] = time.monotonic() + self._spread(interval)
+
+    async def _loop(self, job):
+        # Un bucle por trabajo: uno largo (barras, noticias) no retrasa a los demás (cotizaciones)
+        while True:
+            await asyncio.sleep(max(1.0, job[3] - time.monotonic()))
+            await self.run_job(job)
+
+    def start(self):
+        if not self._tasks: self._tasks = [asyncio.create_task(self._loop(job)) for job in self._jobs]
+
+    async def close(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks: task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {"active_portfolios": len(self.active()), "jobs": [j[0] for j in self._jobs], "runs": dict(self.runs), "errors": dict(self.errors)}
@@ -0,0 +1,108 @@
+import numpy as np
+
+def tracking_error(values, target_weights) -> float:
+    """Distancia (en puntos porcentuales, norma L2) entre los pesos reales de lo invertido y los objetivo."""
+    values = np.asarray(values, dtype=np.float64)
+    total = values.sum()
+    if total <= 0: return 0.0
+    t = np.asarray(target_weights, dtype=np.float64)
+    t = t / t.sum() if t.sum() > 0 else t
+    return float(np.sqrt(((values / total - t) ** 2).sum()) * 100)
+
+def _water_fill(values, goal, budget):
+    """Reparte `budget` entre los activos infraponderados llevándolos a un nivel común (solo compras).
+
+    Busca el nivel lambda tal que sum(max(0, lambda*goal_i - v_i)) = budget; devuelve la compra de cada activo.
+    """
+    if budget <= 0 or goal.sum() <= 0: return np.zeros_like(values)
+    ratio = np.where(goal > 0, values / np.where(goal > 0, goal, 1), np.inf)
+    order = np.argsort(ratio)
+    g, v = goal[order], values[order]
+    cg, cv = np.cumsum(g), np.cumsum(v)
+    # Con los k primeros activos: lambda_k = (budget + cv_k) / cg_k; vale si no supera el ratio del siguiente
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lam = (budget + cv) / cg
+    nxt = np.append(ratio[order][1:], np.inf)
+    ok = np.flatnonzero((cg > 0) & (lam <= nxt))
+    k = ok[0] if len(ok) else len(order) - 1
+    buy = np.zeros_like(values)
+    buy[order[:k + 1]] = np.clip(lam[k] * g[:k + 1] - v[:k + 1], 0, None)
+    return buy
+
+def solve_rebalance(values, prices, target_weights, contribution: float, whole_units: bool = True, allow_sell: bool = False,
+                    min_order: float = 0.0, fee_fixed: float = 0.0, fee_rate: float = 0.0) -> dict:
+    """Órdenes que minimizan el tracking error a los pesos objetivo tras invertir `contribution`.
+
+    1. Solución continua: con ventas, cada activo a su valor objetivo; sin ventas, llenado por niveles
+       (water-filling) de los activos infraponderados con la aportación neta de comisiones.
+    2. Se redondea a unidades enteras hacia cero y se descartan las órdenes menores que `min_order`.
+    3. El efectivo sobrante se asigna de forma voraz: en cada paso se compra el lote (1 unidad, o el mínimo
+       para abrir orden) que más reduce el error cuadrático por euro gastado, mientras quede caja y mejore.
+
+    Devuelve {"units", "amounts", "fees", "cash_left", "tracking_error"} (arrays en el orden de entrada).
+    """
+    v = np.asarray(values, dtype=np.float64)
+    p = np.asarray(prices, dtype=np.float64)
+    t = np.asarray(target_weights, dtype=np.float64)
+    t = t / t.sum() if t.sum() > 0 else np.zeros_like(t)
+    n = len(v)
+    tradable = p > 0
+    total = v.sum() + contribution
+    goal = t * total
+
+    # 1. Solución continua
+    if allow_sell:
+        diff = np.where(tradable, goal - v, 0.0)
+    else:
+        diff = np.zeros(n)
+        diff[tradable] = _water_fill(v[tradable], goal[tradable], contribution / (1 + fee_rate))
+        if fee_fixed > 0:  # la comisión fija depende de cuántas órdenes salen
+            diff[tradable] = _water_fill(v[tradable], goal[tradable], (contribution - fee_fixed * np.count_nonzero(diff > 0)) / (1 + fee_rate))
+    units = np.divide(diff, p, out=np.zeros(n), where=tradable)
+
+    # 2. Unidades enteras y orden mínima
+    if whole_units: units = np.trunc(units)
+    small = np.abs(units * p) < max(min_order, 1e-9)
+    units[small] = 0.0
+
+    def cash_of(u):
+        amount = u * p
+        fees = np.where(u != 0, fee_fixed + np.abs(amount) * fee_rate, 0.0).sum()
+        return contribution - amount.sum() - fees
+
+    # Si las comisiones dejan la caja en negativo, se recorta la compra menos útil hasta cuadrar
+    cash = cash_of(units)
+    while cash < -1e-9 and np.any(units > 0):
+        held = v + units * p
+        with np.errstate(divide="ignore", invalid="ignore"):
+            over = np.where(units > 0, held / np.where(goal > 0, goal, 1), -np.inf)
+        i = int(np.argmax(over))
+        step = 1.0 if whole_units else min(units[i], -cash / p[i] + 1e-9)
+        units[i] -= step
+        if units[i] * p[i] < min_order: units[i] = 0.0
+        cash = cash_of(units)
+
+    # 3. Reparto voraz del sobrante
+    if whole_units:
+        held = v + units * p
+        first = np.where(tradable, np.maximum(1.0, np.ceil(min_order / np.where(tradable, p, 1))), 0.0)
+        while True:
+            lot = np.where(units > 0, 1.0, np.where(units == 0, first, 1.0))
+            cost = lot * p * (1 + fee_rate) + np.where(units == 0, fee_fixed, 0.0)
+            # Variación del error cuadrático sum((held - goal)^2) al comprar el lote
+            delta = lot * p * (2 * (held - goal) + lot * p)
+            ok = tradable & (cost <= cash + 1e-9) & (delta < 0)
+            if not ok.any(): break
+            i = int(np.argmin(np.where(ok, delta / cost, np.inf)))
+            units[i] += lot[i]
+            held[i] += lot[i] * p[i]
+            cash -= cost[i]
+    else:
+        cash = cash_of(units)
+
+    amounts = units * p
+    fees = np.where(units != 0, fee_fixed + np.abs(amounts) * fee_rate, 0.0)
+    return {
+        "units": units, "amounts": amounts, "fees": fees, "cash_left": max(float(cash), 0.0),
+        "tracking_error": tracking_error(v + amounts, t) if n else 0.0,
+    }
@@ -0,0 +1,124 @@
+import os
+import json
+import bisect
+import threading
+
+def _norm(text: str) -> str:
+    return " ".join(str(text or "").lower().split())
+
+def _trigrams(text: str) -> set:
+    text = f"  {text} "
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SearchIndex:
+    """Índice local de activos (ticker + nombre) con búsqueda por prefijo y aproximada por trigramas.
+
+    Las entradas tienen el mismo formato que devuelve /assets/search. Se puede guardar y cargar en JSON.
+    Las fijadas (`pinned`, las de la tabla assets) no caducan; del resto se guardan como mucho `max_entries`
+    y se descartan primero las añadidas hace más tiempo. `dirty` indica cambios sin guardar.
+    """
+
+    def __init__(self, path: str = None, min_similarity: float = 0.5, max_entries: int = 20000):
+        self.path = path
+        self.min_similarity = min_similarity
+        self.max_entries = max_entries
+        self.entries = {}  # ticker -> entry
+        self._pinned = set()
+        self._order = {}  # tickers no fijados, por orden de llegada (se desalojan los primeros)
+        self.dirty = False
+        self._keys = []  # (clave en minúsculas, prioridad, ticker) ordenadas para bisect
+        self._grams = {}  # trigrama -> {ticker}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry: dict, overwrite: bool = True, pinned: bool = False, trim: bool = True):
+        ticker = entry.get("ticker")
+        if not ticker: return
+        with self._lock:
+            if pinned:
+                self._pinned.add(ticker)
+                self._order.pop(ticker, None)
+            if ticker in self.entries:
+                if not overwrite: return
+                self._remove_locked(ticker)
+            self.entries[ticker] = dict(entry)
+            for key in self._entry_keys(entry): bisect.insort(self._keys, key)
+            for g in self._entry_grams(entry): self._grams.setdefault(g, set()).add(ticker)
+            if ticker not in self._pinned:
+                self._order.pop(ticker, None)
+                self._order[ticker] = None
+                while trim and len(self._order) > self.max_entries: self._remove_locked(next(iter(self._order)))
+            self.dirty = True
+
+    def _remove_locked(self, ticker):
+        self._order.pop(ticker, None)
+        old = self.entries.pop(ticker)
+        for key in self._entry_keys(old):
+            i = bisect.bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key: del self._keys[i]
+        for g in self._entry_grams(old):
+            self._grams.get(g, set()).discard(ticker)
+
+    @staticmethod
+    def _entry_keys(entry):
+        ticker, name = entry["ticker"], _norm(entry.get("name"))
+        keys = {(ticker.lower(), 0, ticker)}
+        if name:
+            keys.add((name, 1, ticker))
+            for word in name.split(): keys.add((word, 2, ticker))
+        return keys
+
+    @staticmethod
+    def _entry_grams(entry):
+        return _trigrams(entry["ticker"].lower()) | _trigrams(_norm(entry.get("name")))
+
+    def search(self, q: str, limit: int = 8, fuzzy: bool = True) -> list:
+        """Coincidencias por prefijo (ticker exacto > prefijo de ticker > nombre) y, si faltan, aproximadas."""
+        q = _norm(q)
+        if not q: return []
+        with self._lock:
+            ranked = {}
+            i = bisect.bisect_left(self._keys, (q,))
+            while i < len(self._keys) and self._keys[i][0].startswith(q):
+                key, prio, ticker = self._keys[i]
+                score = -1 if key == q and prio == 0 else prio
+                ranked[ticker] = min(ranked.get(ticker, 9), score)
+                i += 1
+            results = [t for t in sorted(ranked, key=lambda t: (ranked[t], t))]
+            if fuzzy and len(results) < limit:
+                grams = _trigrams(q)
+                counts = {}
+                for g in grams:
+                    for t in self._grams.get(g, ()):
+                        if t not in ranked: counts[t] = counts.get(t, 0) + 1
+                close = [(c / len(grams), t) for t, c in counts.items() if c / len(grams) >= self.min_similarity]
+                results += [t for _, t in sorted(close, key=lambda x: (-x[0], x[1]))]
+            return [dict(self.entries[t]) for t in results[:limit]]
+
+    def save(self, path: str = None):
+        path = path or self.path
+        if not path: return
+        # Primero las fijadas y luego el resto por antigüedad, para que al cargar se conserve el orden de desalojo
+        with self._lock:
+            data = [self.entries[t] for t in self.entries if t in self._pinned] + [self.entries[t] for t in self._order]
+            self.dirty = False
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f: json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError:
+            self.dirty = True
+            raise
+
+    def load(self, path: str = None):
+        path = path or self.path
+        if not path or not os.path.exists(path): return
+        try:
+            with open(path, encoding="utf-8") as f: data = json.load(f)
+        except (OSError, ValueError): return
+        # Sin recortar: las de la tabla assets vienen sin marca y se fijan después al sembrar desde la base de datos
+        for entry in data: self.add(entry, overwrite=False, trim=False)
+        self.dirty = False
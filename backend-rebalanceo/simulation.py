@@ -0,0 +1,233 @@
+import numpy as np
+import pandas as pd
+
+TAX_RATE = 0.19  # Tributación de plusvalías al final del horizonte
+PERCENTILES = (5, 25, 50, 75, 95)
+# Arrays del tamaño de la rejilla (escenarios x caminos) vivos a la vez en run_grid: bruto, neto con impuestos e
+# índices del camino mediano. La matriz de aleatorios (meses x caminos) se libera antes de crearlos
+GRID_ARRAYS = 3
+
+def contribution_schedule(months: int, monthly: float, mode: str = "constant", growth_rate: float = 0.0) -> np.ndarray:
+    """Aportación de cada mes 1..months. En modo 'growing' sube growth_rate% cada 12 meses."""
+    m = np.arange(1, months + 1)
+    if mode == 'growing':
+        return monthly * (1 + growth_rate / 100) ** (m // 12)
+    return np.full(months, float(monthly))
+
+def normal_growth(rng: np.random.Generator, paths: int, months: int, mu: float, sigma: float) -> np.ndarray:
+    """Factores de crecimiento mensuales 1 + N(mu, sigma) como matriz (months x paths).
+
+    Usa variables antitéticas (la mitad de los caminos son el espejo de la otra mitad):
+    la mitad de números aleatorios y menos varianza en los percentiles.
+    """
+    if sigma <= 0: return np.full((months, paths), 1 + mu)
+    growth = np.empty((months, paths), dtype=np.float32)
+    half = (paths + 1) // 2
+    z = rng.standard_normal((months, half), dtype=np.float32)
+    np.multiply(z, sigma, out=growth[:, :half])
+    np.negative(growth[:, :paths - half], out=growth[:, half:])
+    growth += 1 + mu
+    return growth
+
+def bootstrap_growth(rng: np.random.Generator, returns: np.ndarray, paths: int, months: int, block: int = 12) -> np.ndarray:
+    """Factores de crecimiento (months x paths) remuestreando bloques consecutivos de rentabilidades históricas.
+
+    Los bloques conservan la autocorrelación y las colas reales de la serie.
+    """
+    block = max(1, min(block, len(returns)))
+    n_blocks = -(-months // block)
+    starts = rng.integers(0, len(returns) - block + 1, size=(n_blocks, 1, paths))
+    idx = (starts + np.arange(block)[None, :, None]).reshape(n_blocks * block, paths)[:months]
+    return (1 + returns[idx]).astype(np.float32)
+
+def estimate_return_stats(close: pd.DataFrame, min_months: int = 12) -> dict:
+    """Rentabilidades mensuales, media y covarianza por activo a partir de cierres (columnas = tickers)."""
+    monthly = close.resample("ME").last().pct_change(fill_method=None).iloc[1:]
+    monthly = monthly.dropna(axis=1, how="all")
+    joint = monthly.dropna()
+    # Si el histórico común es muy corto, se rellenan huecos con la media de cada activo
+    if len(joint) < min_months: joint = monthly.fillna(monthly.mean())
+    if joint.empty: return None
+    values = joint.to_numpy(dtype=np.float64)
+    return {
+        "tickers": list(joint.columns),
+        "returns": values,
+        "mean": values.mean(axis=0),
+        "cov": np.atleast_2d(np.cov(values, rowvar=False)),
+        "months": len(values),
+    }
+
+def portfolio_moments(stats: dict, weights: np.ndarray):
+    """Media y volatilidad mensual de la cartera rebalanceada a pesos fijos: w·mu y sqrt(w'Σw)."""
+    return float(weights @ stats["mean"]), float(np.sqrt(max(weights @ stats["cov"] @ weights, 0.0)))
+
+def simulate_paths(start_value: float, contributions: np.ndarray, growth: np.ndarray) -> np.ndarray:
+    """Valor a cierre de cada año (years+1 x paths) para V_m = V_{m-1} * g_m + c_m.
+
+    El bucle es por mes, pero cada paso opera sobre todos los caminos a la vez.
+    """
+    months, paths = growth.shape
+    yearly = np.empty((months // 12 + 1, paths))
+    value = np.full(paths, float(start_value))
+    yearly[0] = value
+    for m in range(months):
+        value *= growth[m]
+        value += contributions[m]
+        if (m + 1) % 12 == 0: yearly[(m + 1) // 12] = value
+    return yearly
+
+def summarize(yearly: np.ndarray, total_invested: float, apply_tax: bool, target: float = None) -> dict:
+    """Bandas de percentiles por año y métricas de probabilidad a partir de la matriz de caminos."""
+    years = np.arange(yearly.shape[0])
+    bands = np.percentile(yearly, PERCENTILES, axis=1)
+
+    final = yearly[-1]
+    gain = final - total_invested
+    tax = np.where(gain > 0, gain * TAX_RATE, 0.0) if apply_tax else np.zeros_like(final)
+    net = final - tax
+
+    # Camino mediano (por valor neto) para que bruto/neto/impuestos cuadren entre sí
+    median_idx = int(np.argpartition(net, len(net) // 2)[len(net) // 2])
+    res = {
+        "data": [{"year": float(y), "value": round(float(v))} for y, v in zip(years, bands[2])],
+        "bands": [{"year": float(y), **{f"p{p}": round(float(b[i])) for p, b in zip(PERCENTILES, bands)}} for i, y in enumerate(years)],
+        "final_gross": round(float(final[median_idx])),
+        "final_net": round(float(net[median_idx])),
+        "total_invested": round(float(total_invested)),
+        "tax_paid": round(float(tax[median_idx])),
+        "gain": round(float(gain[median_idx])),
+        "paths": int(yearly.shape[1]),
+        "probabilities": {"loss": round(float(np.mean(net < total_invested)), 4)},
+    }
+    if target is not None:
+        res["probabilities"]["target"] = round(float(np.mean(net >= target)), 4)
+    return res
+
+def run_projection(start_value: float, years: int, monthly: float, mode: str, growth_rate: float,
+                   mu: float, sigma: float, paths: int, apply_tax: bool, target: float = None, seed: int = None) -> dict:
+    """Proyección completa con rentabilidad mensual N(mu, sigma). Con sigma=0 es la proyección lineal (1 camino)."""
+    months = years * 12
+    contributions = contribution_schedule(months, monthly, mode, growth_rate)
+    if sigma <= 0: paths = 1
+    growth = normal_growth(np.random.default_rng(seed), paths, months, mu, sigma)
+    yearly = simulate_paths(start_value, contributions, growth)
+    return summarize(yearly, start_value + contributions.sum(), apply_tax, target)
+
+def run_historical_projection(start_value: float, years: int, monthly: float, mode: str, growth_rate: float,
+                              stats: dict, weights: np.ndarray, method: str, paths: int, apply_tax: bool,
+                              target: float = None, seed: int = None, block: int = 12) -> dict:
+    """Proyección con parámetros estimados del histórico real de los activos.
+
+    method='historical': bootstrap por bloques de la rentabilidad mensual histórica de la cartera.
+    method='covariance': normal multivariante (medias + covarianza); con pesos fijos, la combinación
+    de activos correlados es exactamente N(w·mu, w'Σw), así que basta con simular la cartera.
+    """
+    months = years * 12
+    contributions = contribution_schedule(months, monthly, mode, growth_rate)
+    rng = np.random.default_rng(seed)
+    mu, sigma = portfolio_moments(stats, weights)
+    if method == 'historical':
+        growth = bootstrap_growth(rng, stats["returns"] @ weights, paths, months, block)
+    else:
+        growth = normal_growth(rng, paths, months, mu, sigma)
+    yearly = simulate_paths(start_value, contributions, growth)
+    res = summarize(yearly, start_value + contributions.sum(), apply_tax, target)
+    res["model"] = {
+        "method": method, "months_of_history": stats["months"],
+        "annual_return": round(mu * 12 * 100, 2), "annual_volatility": round(sigma * 12 ** 0.5 * 100, 2),
+    }
+    return res
+
+def run_grid(portfolio_ids, start_values, annual_returns, volatilities, modes, monthly_contributions, years, taxes,
+             growth_rate: float = 0.0, paths: int = 1000, target: float = None, seed: int = None) -> dict:
+    """Rejilla de escenarios (carteras x rentabilidad x volatilidad x modo x aportación x años x impuestos) en una pasada.
+
+    El valor es lineal en el capital inicial y en la aportación: V = V0 * A + aportación * D, con A el crecimiento
+    acumulado de cada camino y D el de una aportación unitaria según el modo. Se simulan A y D una vez por
+    (rentabilidad, volatilidad, modo) con los mismos números aleatorios para todos los escenarios, y el resto
+    de ejes se obtiene por broadcasting. Devuelve columnas (listas paralelas), una fila por escenario.
+    """
+    v0 = np.asarray(start_values, dtype=np.float64)
+    mu = np.asarray(annual_returns, dtype=np.float64) / 12
+    sigma = np.asarray(volatilities, dtype=np.float64) / 12 ** 0.5
+    monthly = np.asarray(monthly_contributions, dtype=np.float64)
+    horizons = sorted(set(int(y) for y in years))
+    months = horizons[-1] * 12
+    if not (sigma > 0).any(): paths = 1
+    z = normal_growth(np.random.default_rng(seed), paths, months, 0.0, 1.0) - 1 if paths > 1 else np.zeros((months, 1))
+    unit = np.stack([contribution_schedule(months, 1.0, m, growth_rate) for m in modes])  # (K, months)
+
+    # Crecimiento acumulado (R, V, paths) y aportación unitaria acumulada (R, V, K, paths), mes a mes sobre toda la rejilla
+    R, V, K = len(mu), len(sigma), len(modes)
+    A = np.ones((R, V, paths))
+    D = np.zeros((R, V, K, paths))
+    A_y = np.empty((len(horizons), R, V, paths))
+    D_y = np.empty((len(horizons), R, V, K, paths))
+    checkpoints = {y * 12: i for i, y in enumerate(horizons)}
+    for m in range(months):
+        g = 1 + mu[:, None, None] + sigma[None, :, None] * z[m]
+        A *= g
+        D *= g[:, :, None]
+        D += unit[None, None, :, m, None]
+        if m + 1 in checkpoints:
+            A_y[checkpoints[m + 1]] = A
+            D_y[checkpoints[m + 1]] = D
+    del z, A, D
+
+    # (P, R, V, K, C, Y, paths)
+    # Se rellena en su sitio (una aportación cada vez) para no crear temporales del tamaño de la rejilla
+    gross = np.empty((len(v0), R, V, K, len(monthly), len(horizons), paths))
+    np.multiply(v0[:, None, None, None, None, None, None], A_y.transpose(1, 2, 0, 3)[None, :, :, None, None, :, :], out=gross)
+    D_t = D_y.transpose(1, 2, 3, 0, 4)[None]
+    for c, amount in enumerate(monthly): gross[:, :, :, :, c] += amount * D_t
+    invested_unit = np.stack([unit[:, :y * 12].sum(axis=1) for y in horizons], axis=1)  # (K, Y)
+    invested = v0[:, None, None, None, None, None] + monthly[None, None, None, None, :, None] * invested_unit[None, None, None, :, None, :]
+    del A_y, D_y
+
+    cols = {k: [] for k in ("final_gross", "final_net", "tax_paid", "prob_loss", "prob_target")}
+    taxed = None
+    for flag in taxes:
+        if flag and taxed is None:
+            # Neto tras el impuesto sobre la plusvalía, en un único array y sin temporales del tamaño de la rejilla
+            taxed = np.subtract(gross, invested[..., None])
+            np.clip(taxed, 0.0, None, out=taxed)
+            taxed *= TAX_RATE
+            np.subtract(gross, taxed, out=taxed)
+        # Sin impuestos el neto es el propio bruto (sin copia)
+        net = taxed if flag else gross
+        # Camino mediano por valor neto, como en summarize (copia del índice para liberar el argpartition completo)
+        mid = np.argpartition(net, paths // 2, axis=-1)[..., paths // 2, None].copy()
+        final_gross = np.take_along_axis(gross, mid, axis=-1)[..., 0]
+        final_net = np.take_along_axis(net, mid, axis=-1)[..., 0]
+        cols["final_gross"].append(final_gross)
+        cols["final_net"].append(final_net)
+        cols["tax_paid"].append(final_gross - final_net)
+        cols["prob_loss"].append((net < invested[..., None]).mean(axis=-1))
+        if target is not None: cols["prob_target"].append((net >= target).mean(axis=-1))
+        del net, mid
+    del taxed
+    # Último uso de gross: los percentiles pueden reordenarlo en su sitio en vez de copiarlo
+    bands = np.percentile(gross, PERCENTILES, axis=-1, overwrite_input=True)
+    del gross
+
+    shape = (len(v0), R, V, K, len(monthly), len(horizons), len(taxes))
+    axes = np.indices(shape).reshape(len(shape), -1)
+    flat = lambda a: np.stack(a, axis=-1).reshape(-1)  # Añade el eje de impuestos al final
+    per_tax = lambda a: np.broadcast_to(a[..., None], shape).reshape(-1)
+    money = lambda a: np.rint(a).astype(np.int64).tolist()
+    out = {
+        "portfolio_id": [portfolio_ids[i] for i in axes[0]],
+        "annual_return": [float(annual_returns[i]) for i in axes[1]],
+        "volatility": [float(volatilities[i]) for i in axes[2]],
+        "contribution_mode": [modes[i] for i in axes[3]],
+        "monthly_contribution": [float(monthly[i]) for i in axes[4]],
+        "years": [horizons[i] for i in axes[5]],
+        "tax": [bool(taxes[i]) for i in axes[6]],
+        "start_value": np.round(v0[axes[0]], 2).tolist(),
+        "total_invested": money(per_tax(invested)),
+    }
+    for k in ("final_gross", "final_net", "tax_paid"): out[k] = money(flat(cols[k]))
+    for p, band in zip(PERCENTILES, bands): out[f"p{p}"] = money(per_tax(band))
+    out["prob_loss"] = np.round(flat(cols["prob_loss"]), 4).tolist()
+    if target is not None: out["prob_target"] = np.round(flat(cols["prob_target"]), 4).tolist()
+    return {"scenarios": len(out["portfolio_id"]), "paths": paths, "columns": out}
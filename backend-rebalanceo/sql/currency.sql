@@ -0,0 +1,3 @@
+-- Divisa de valoración de cada cartera (ejecutar en el SQL editor de Supabase).
+-- El backend convierte cada posición desde assets.currency a esta divisa; sin la columna usa BASE_CURRENCY.
+alter table portfolios add column if not exists base_currency text not null default 'EUR';
@@ -0,0 +1,78 @@
+-- Funciones RPC de rebalanceo (ejecutar en el SQL editor de Supabase).
+-- Cada llamada es una sola transacción: o se aplica todo o nada.
+
+-- Aplica un rebalanceo completo: cabecera + items del histórico + unidades de cada posición.
+-- p_orders: [{"id", "asset_name", "ticker", "action", "units" (con signo), "amount", "price"}]
+-- p_value_before: valor de toda la cartera antes del rebalanceo, calculado por el backend (precio de la orden o
+-- cotización actual para las posiciones sin orden). Si es null se usan solo las posiciones con orden.
+drop function if exists apply_rebalance(uuid, numeric, jsonb);
+create or replace function apply_rebalance(p_portfolio_id uuid, p_contribution numeric, p_orders jsonb, p_value_before numeric default null)
+returns uuid
+language plpgsql
+as $$
+declare
+  v_history_id uuid;
+  v_before numeric;
+begin
+  -- Bloquea las posiciones de la cartera para serializar ediciones concurrentes
+  perform 1 from portfolio_items where portfolio_id = p_portfolio_id for update;
+
+  if p_value_before is not null then
+    v_before := p_value_before;
+  else
+    select coalesce(sum(pi.units_held * (o->>'price')::numeric), 0) into v_before
+    from jsonb_array_elements(p_orders) o
+    join portfolio_items pi on pi.id = (o->>'id')::uuid and pi.portfolio_id = p_portfolio_id;
+  end if;
+
+  insert into rebalance_history (portfolio_id, contribution, total_value_before, total_value_after)
+  values (p_portfolio_id, p_contribution, v_before, v_before + p_contribution)
+  returning id into v_history_id;
+
+  insert into rebalance_history_items (history_id, asset_name, ticker, action, units, amount, price)
+  select v_history_id, coalesce(o->>'asset_name', 'Desconocido'), coalesce(o->>'ticker', ''), o->>'action',
+         abs((o->>'units')::numeric), abs((o->>'amount')::numeric), (o->>'price')::numeric
+  from jsonb_array_elements(p_orders) o
+  where abs((o->>'units')::numeric) > 0.00001;
+
+  update portfolio_items pi
+  set units_held = greatest(0, pi.units_held + (o->>'units')::numeric)
+  from jsonb_array_elements(p_orders) o
+  where pi.id = (o->>'id')::uuid and pi.portfolio_id = p_portfolio_id
+    and abs((o->>'units')::numeric) > 0.00001;
+
+  update portfolios set last_contribution = p_contribution where id = p_portfolio_id;
+  return v_history_id;
+end;
+$$;
+
+-- Deshace un rebalanceo: revierte las unidades de todos sus items y borra la cabecera.
+-- Los items se agregan por activo (ticker -> assets.id) y se aplican en un único UPDATE.
+create or replace function undo_rebalance(p_history_id uuid)
+returns void
+language plpgsql
+as $$
+declare
+  v_portfolio_id uuid;
+begin
+  select portfolio_id into v_portfolio_id from rebalance_history where id = p_history_id for update;
+  if not found then
+    raise exception 'History not found' using errcode = 'P0002';
+  end if;
+
+  perform 1 from portfolio_items where portfolio_id = v_portfolio_id for update;
+
+  update portfolio_items pi
+  set units_held = greatest(0, pi.units_held + d.delta)
+  from (
+    select a.id as asset_id, sum(case when hi.action = 'BUY' then -hi.units else hi.units end) as delta
+    from rebalance_history_items hi
+    join assets a on a.ticker = hi.ticker
+    where hi.history_id = p_history_id
+    group by a.id
+  ) d
+  where pi.portfolio_id = v_portfolio_id and pi.asset_id = d.asset_id;
+
+  delete from rebalance_history where id = p_history_id;
+end;
+$$;
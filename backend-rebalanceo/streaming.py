@@ -0,0 +1,99 @@
+import asyncio
+
+def _key(item: dict):
+    return (item.get("current_price"), item.get("value"), item.get("real_weight"))
+
+class PortfolioStream:
+    """Valoraciones en vivo por cartera con un único poller en segundo plano compartido.
+
+    En cada tick se llama una sola vez a `snapshot(portfolio_ids) -> {portfolio_id: items valorados}`
+    para todas las carteras con suscriptores (una descarga de precios para la unión de tickers) y
+    a cada suscriptor solo se le envían las posiciones cuyo precio, valor o peso real han cambiado.
+    El poller arranca con el primer suscriptor y se detiene cuando se va el último.
+    """
+
+    def __init__(self, snapshot, interval: float = 60.0, queue_size: int = 32):
+        self.snapshot = snapshot
+        self.interval = interval
+        self.queue_size = queue_size
+        self._subs = {}  # portfolio_id -> {asyncio.Queue}
+        self._items = {}  # portfolio_id -> último snapshot completo
+        self._task = None
+        self.ticks = 0
+        self.messages = 0
+
+    def _message(self, kind: str, portfolio_id: str, items: list, total: float) -> dict:
+        return {"type": kind, "portfolio_id": portfolio_id, "items": items, "total_value": total}
+
+    def _full(self, portfolio_id: str) -> dict:
+        items = self._items.get(portfolio_id, [])
+        return self._message("snapshot", portfolio_id, items, round(sum(x["value"] for x in items), 2))
+
+    def _send(self, queue: asyncio.Queue, msg: dict, portfolio_id: str):
+        # Cliente lento: se descarta lo pendiente y se le manda el estado completo para que no pierda cambios
+        if queue.full():
+            while not queue.empty(): queue.get_nowait()
+            msg = self._full(portfolio_id)
+        queue.put_nowait(msg)
+        self.messages += 1
+
+    async def subscribe(self, portfolio_id: str) -> asyncio.Queue:
+        """Cola de mensajes de la cartera; el primero es siempre el snapshot completo."""
+        if portfolio_id not in self._items:
+            self._items[portfolio_id] = (await self.snapshot([portfolio_id])).get(portfolio_id, [])
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subs.setdefault(portfolio_id, set()).add(queue)
+        self._send(queue, self._full(portfolio_id), portfolio_id)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, portfolio_id: str, queue: asyncio.Queue):
+        subs = self._subs.get(portfolio_id)
+        if subs is not None:
+            subs.discard(queue)
+            if not subs:
+                del self._subs[portfolio_id]
+                self._items.pop(portfolio_id, None)
+        if not self._subs and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, portfolio_id: str, items: list):
+        """Compara con el último snapshot y difunde los cambios (o el snapshot entero si cambió la composición)."""
+        if portfolio_id not in self._subs or items is None: return
+        old = {x["id"]: x for x in self._items.get(portfolio_id, [])}
+        self._items[portfolio_id] = items
+        if set(old) != {x["id"] for x in items}:
+            msg = self._full(portfolio_id)
+        else:
+            changed = [{"id": x["id"], "current_price": x["current_price"], "value": x["value"], "real_weight": x["real_weight"]}
+                       for x in items if _key(x) != _key(old[x["id"]])]
+            if not changed: return
+            msg = self._message("update", portfolio_id, changed, round(sum(x["value"] for x in items), 2))
+        for queue in list(self._subs[portfolio_id]): self._send(queue, msg, portfolio_id)
+
+    async def poll(self):
+        """Un tick: una llamada a `snapshot` para todas las carteras suscritas."""
+        ids = list(self._subs)
+        if not ids: return
+        snaps = await self.snapshot(ids)
+        self.ticks += 1
+        for portfolio_id in ids: self.publish(portfolio_id, snaps.get(portfolio_id))
+
+    async def _run(self):
+        while self._subs:
+            await asyncio.sleep(self.interval)
+            try: await self.poll()
+            except Exception as e: print(f"Stream poll error: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "portfolios": len(self._subs), "subscribers": sum(len(s) for s in self._subs.values()),
+            "interval": self.interval, "ticks": self.ticks, "messages": self.messages,
+        }
@@ -0,0 +1,151 @@
+import os
+import time
+import threading
+import urllib.parse
+import numpy as np
+import pandas as pd
+from history_store import to_epoch
+
+# Un punto diario del valor de una cartera; ts en segundos epoch (fecha de mercado, como las barras diarias)
+POINT_DTYPE = np.dtype([("ts", "<i8"), ("value", "<f8")])
+
+def market_day(when) -> pd.Timestamp:
+    """Fecha (sin zona) de un instante; los created_at de Supabase vienen en UTC con zona."""
+    ts = pd.Timestamp(when)
+    if ts.tz is not None: ts = ts.tz_convert("UTC").tz_localize(None)
+    return ts.normalize()
+
+def unit_matrix(dates: pd.DatetimeIndex, tickers, current: dict, events) -> np.ndarray:
+    """Unidades de cada ticker en cada fecha (T x N) a partir de las actuales y los movimientos del histórico.
+
+    `events`: [(fecha, {ticker: unidades con signo})]. Un movimiento cuenta desde su fecha (incluida); antes de él
+    las unidades son las actuales menos todo lo movido después. Se recorta a 0 como hace la base de datos.
+    """
+    col = {t: j for j, t in enumerate(tickers)}
+    now = np.array([current.get(t, 0.0) for t in tickers], dtype=np.float64)
+    steps = np.zeros((len(dates) + 1, len(tickers)))
+    for when, deltas in events:
+        i = dates.searchsorted(market_day(when))
+        for t, d in deltas.items():
+            if t in col: steps[i, col[t]] += d
+    moved = steps.sum(axis=0)
+    units = (now - moved) + np.cumsum(steps[:-1], axis=0)
+    return np.clip(units, 0.0, None)
+
+def value_points(closes: pd.DataFrame, current: dict, factors: dict, events) -> np.ndarray:
+    """Serie diaria de valor en la divisa base.
+
+    closes: cierres diarios (una columna por ticker de activo y de tipo de cambio);
+    factors: {ticker: (ticker de FX o None, factor de subunidad)}. Sin tipo de cambio la posición vale 0.
+    """
+    tickers = [t for t in factors if t in closes.columns]
+    if closes.empty or not tickers: return np.empty(0, dtype=POINT_DTYPE)
+    df = closes.sort_index().ffill().bfill()
+    prices = df[tickers].to_numpy(dtype=np.float64)
+    fx = np.ones_like(prices)
+    for j, t in enumerate(tickers):
+        pair, minor = factors[t]
+        if pair is None: fx[:, j] = minor
+        elif pair in df.columns: fx[:, j] = minor * df[pair].to_numpy(dtype=np.float64)
+        else: fx[:, j] = 0.0
+    values = np.nansum(unit_matrix(df.index, tickers, current, events) * prices * fx, axis=1)
+    out = np.empty(len(df), dtype=POINT_DTYPE)
+    out["ts"] = to_epoch(df.index, "1d")
+    out["value"] = values
+    return out
+
+def lttb(x: np.ndarray, y: np.ndarray, n: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets: índices de `n` puntos que conservan la forma de la serie (incluye extremos)."""
+    size = len(x)
+    if n >= size or n < 3: return np.arange(size)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, size - 1, n - 1).astype(np.int64)
+    out = np.empty(n, dtype=np.int64)
+    out[0], out[-1] = 0, size - 1
+    a = 0
+    for k in range(n - 2):
+        lo, hi = edges[k], edges[k + 1]
+        # Media del cubo siguiente (el último cubo apunta al punto final)
+        nlo, nhi = hi, edges[k + 2] if k + 2 < len(edges) else size
+        cx, cy = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - cx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (cy - y[a]))
+        a = lo + int(area.argmax())
+        out[k + 1] = a
+    return out
+
+class ValueSeriesStore:
+    """Serie diaria precalculada del valor de cada cartera: un .npy (POINT_DTYPE) por cartera.
+
+    Se amplía por la cola cuando caduca (`refresh`, al ritmo de las barras diarias) y se invalida
+    desde una fecha cuando cambian las unidades (aplicar/deshacer rebalanceo) o entera si cambia el pasado.
+    """
+
+    def __init__(self, root: str, refresh: float = 3600):
+        self.root = root
+        self.refresh = refresh
+        self._versions = {}  # portfolio_id -> nº de invalidaciones (descarta escrituras de cálculos ya obsoletos)
+        self._lock = threading.Lock()
+        self.builds = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, portfolio_id: str) -> str:
+        return os.path.join(self.root, urllib.parse.quote(str(portfolio_id), safe="") + ".npy")
+
+    def load(self, portfolio_id: str):
+        path = self._path(portfolio_id)
+        if not os.path.exists(path): return None
+        try: return np.load(path, mmap_mode="r")
+        except (ValueError, OSError): return None
+
+    def is_fresh(self, portfolio_id: str) -> bool:
+        try: return time.time() - os.path.getmtime(self._path(portfolio_id)) < self.refresh
+        except OSError: return False
+
+    def version(self, portfolio_id: str) -> int:
+        with self._lock: return self._versions.get(portfolio_id, 0)
+
+    def tail_start(self, portfolio_id: str, margin_days: int = 7):
+        """Desde dónde recalcular: unos días antes del último punto guardado (None = serie completa)."""
+        points = self.load(portfolio_id)
+        if points is None or not len(points): return None
+        return pd.Timestamp(int(points["ts"][-1]), unit="s") - pd.Timedelta(days=margin_days)
+
+    def write(self, portfolio_id: str, points: np.ndarray, version: int) -> bool:
+        """Fusiona `points` (sustituyen desde su primera fecha) salvo que la serie se haya invalidado mientras tanto."""
+        path = self._path(portfolio_id)
+        with self._lock:
+            if self._versions.get(portfolio_id, 0) != version: return False
+            old = self.load(portfolio_id)
+            points = np.sort(points, order="ts")
+            if old is not None and len(old):
+                keep = old[old["ts"] < points["ts"][0]] if len(points) else old
+                points = np.concatenate([np.asarray(keep), points])
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f: np.save(f, points)
+            os.replace(tmp, path)
+            self.builds += 1
+        return True
+
+    def invalidate(self, portfolio_id: str, since=None):
+        """Descarta los puntos desde `since` (fecha) o toda la serie si es None."""
+        path = self._path(portfolio_id)
+        with self._lock:
+            self._versions[portfolio_id] = self._versions.get(portfolio_id, 0) + 1
+            old = self.load(portfolio_id)
+            if old is None: return
+            if since is None:
+                os.remove(path)
+                return
+            cut = int((market_day(since) - pd.Timestamp(0)) // pd.Timedelta(seconds=1))
+            kept = np.asarray(old[old["ts"] < cut])
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f: np.save(f, kept)
+            os.replace(tmp, path)
+            # Marca la serie como caducada: la próxima lectura recalcula la cola que falta
+            os.utime(path, (0, 0))
+
+    def series(self, portfolio_id: str) -> pd.Series:
+        points = self.load(portfolio_id)
+        if points is None or not len(points): return pd.Series(dtype=np.float64)
+        return pd.Series(np.asarray(points["value"]), index=pd.to_datetime(np.asarray(points["ts"]), unit="s"))